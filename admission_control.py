@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Request priorities; lower values are admitted first
+INTERACTIVE = 0
+BULK = 1
+
+
+class TokenBucket:
+    """Budget of ``per_minute`` units that refills continuously."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` units are available; 0 when they are now.
+        Requests larger than the whole bucket only wait for a full bucket."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        # The level may go negative when a request used more than estimated;
+        # later requests then wait for the debt to refill
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AdmissionController:
+    """Process-wide gate in front of a rate-limited API.
+
+    ``acquire`` blocks until both the requests-per-minute and the
+    tokens-per-minute budgets allow another request, admitting waiting
+    callers strictly by priority and then arrival order. Callers report the
+    tokens actually used with ``settle`` and a server-side rate limit with
+    ``pause``.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def _delay(self, tokens, now):
+        delay = max(self._paused_until - now, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    def acquire(self, tokens=0, priority=INTERACTIVE):
+        """Wait for a slot for a request estimated at ``tokens`` tokens and
+        return the number of tokens charged for it."""
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    delay = None
+                    if self._waiting[0] == entry:
+                        delay = self._delay(tokens, time.monotonic())
+                        if delay <= 0:
+                            self.requests.take(1)
+                            if self.tokens is not None:
+                                self.tokens.take(tokens)
+                            return tokens
+                    self._condition.wait(delay)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def settle(self, charged, used):
+        """Correct the token budget once the real usage of a request is known."""
+        if self.tokens is None or used == charged:
+            return
+        with self._condition:
+            self.tokens.adjust(charged - used)
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """Stop admitting requests for ``seconds``, e.g. after a 429."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
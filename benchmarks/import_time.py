@@ -0,0 +1,93 @@
+"""Cold-start budget check for the Streamlit app.
+
+Imports the router and every page module in a fresh interpreter, reports the
+wall-clock import time and exits non-zero when a module exceeds its budget or
+when the router pulls in a heavy dependency that should load lazily.
+
+    python benchmarks/import_time.py [--repeat 3] [--scale 1.0]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold import budgets in seconds, measured on the production container
+IMPORT_BUDGETS = {
+    "userinterface": 2.0,
+    "navigation.emergency_contacts": 2.5,
+    "navigation.manual": 3.0,
+    "navigation.translate": 4.0,
+    "navigation.forex": 4.0,
+    "navigation.youtube": 4.5,
+}
+
+# Modules that must not be imported just by starting the router
+LAZY_MODULES = [
+    "spacy",
+    "matplotlib",
+    "pandas",
+    "reportlab",
+    "google.cloud.texttospeech",
+    "pytube",
+    "pydub",
+    "openai",
+    "navigation.youtube",
+    "navigation.manual",
+    "navigation.translate",
+    "navigation.forex",
+    "navigation.emergency_contacts",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, lazy=LAZY_MODULES)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply every budget by this"
+    )
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<34}{'median s':>10}{'budget s':>10}")
+    for module, budget in IMPORT_BUDGETS.items():
+        runs = [measure(module) for _ in range(args.repeat)]
+        median = statistics.median(run["elapsed"] for run in runs)
+        budget *= args.scale
+        print(f"{module:<34}{median:>10.3f}{budget:>10.2f}")
+        if median > budget:
+            failures.append(f"{module} imported in {median:.3f}s > {budget:.2f}s")
+        if module == "userinterface" and runs[0]["loaded"]:
+            failures.append(
+                f"userinterface eagerly imports {', '.join(runs[0]['loaded'])}"
+            )
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""End-to-end latency benchmark of core_helpers and the page flows.
+
+Starts the local API stand-ins (benchmarks/stand_ins.py), points the app at
+them, runs each page's work outside Streamlit and reports per-stage and
+per-flow latency percentiles in milliseconds.
+
+    python benchmarks/page_flows.py [--iterations 5] [--latency-scale 1.0]
+        [--jitter 0.2] [--warm] [--flows youtube manual ...] [--json out.json]
+
+Every iteration starts from empty response caches unless --warm is given.
+The YouTube flow starts from a synthetic audio file, as pytube talks to
+YouTube directly. Without tiktoken's encoding in its local cache, token
+counts fall back to an estimate.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandInServer  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+FLOWS = ["core_helpers", "youtube", "manual", "emergency", "translate", "forex"]
+
+# Inputs of each flow
+TRANSLATION_PHRASES = [f"Where is the nearest stop for bus {i}?" for i in range(60)]
+ITINERARY_DAYS = 3
+PHRASEBOOK_CITIES = ["Paris", "Kyoto", "Lima"]
+EMERGENCY_CITY = "Barcelona"
+STATEMENT_ROWS = 5000
+AUDIO_BYTES = 1024 * 1024
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        # Failed stages raise past this point and are not recorded
+        self.samples[name].append(time.perf_counter() - start)
+
+    def report(self):
+        rows = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            row = {"n": len(samples), "mean": statistics.mean(samples) * 1000}
+            for percentile in PERCENTILES:
+                # Nearest-rank percentile
+                index = max(0, math.ceil(len(ordered) * percentile / 100) - 1)
+                row[f"p{percentile}"] = ordered[index] * 1000
+            row["max"] = ordered[-1] * 1000
+            rows[name] = row
+        return rows
+
+
+def synthetic_audio():
+    audio = BytesIO(bytes(AUDIO_BYTES))
+    audio.name = "audio.mp4"
+    return audio
+
+
+def flow_core_helpers(recorder):
+    from core_helpers import (
+        generate_itinerary_by_user_specs,
+        transcribe_audio_detailed,
+        translate_batch,
+        translate_text,
+    )
+
+    with recorder.stage("core_helpers.translate_text"):
+        translate_text("Where is the train station?", "French")
+    with recorder.stage("core_helpers.translate_batch"):
+        translate_batch(TRANSLATION_PHRASES, "Japanese")
+    with recorder.stage("core_helpers.transcribe_audio_detailed"):
+        transcribe_audio_detailed(synthetic_audio())
+    with recorder.stage("core_helpers.generate_itinerary_by_user_specs"):
+        generate_itinerary_by_user_specs("Paris", ITINERARY_DAYS)
+
+
+def flow_youtube(recorder):
+    from core_helpers import generate_itinerary_by_youtube, transcribe_audio_detailed
+    from navigation.youtube import build_itinerary_artifacts
+
+    with recorder.stage("youtube.transcribe"):
+        transcript = transcribe_audio_detailed(synthetic_audio())["text"]
+    with recorder.stage("youtube.itinerary"):
+        itinerary = "".join(
+            generate_itinerary_by_youtube(transcript, ITINERARY_DAYS, stream=True)
+        )
+    with recorder.stage("youtube.artifacts"):
+        build_itinerary_artifacts(itinerary.strip())
+
+
+def flow_manual(recorder):
+    from navigation.manual import phrasebook_tasks
+    from task_graph import run_task_graph
+
+    with recorder.stage("manual.phrasebooks"):
+        for _, future in run_task_graph(phrasebook_tasks(PHRASEBOOK_CITIES)):
+            future.result()
+
+
+def flow_emergency(recorder):
+    from navigation.emergency_contacts import generate_local_details
+    from locale_index import emergency_numbers
+
+    with recorder.stage("emergency.numbers"):
+        country, _ = emergency_numbers(EMERGENCY_CITY)
+    with recorder.stage("emergency.local_details"):
+        generate_local_details(EMERGENCY_CITY, country)
+
+
+def flow_translate(recorder):
+    from core_helpers import translate_text
+    from tts_helpers import synthesize_speech
+
+    with recorder.stage("translate.text"):
+        translated, _, code = translate_text("Two coffees, please", "Spanish")
+    with recorder.stage("translate.speech"):
+        synthesize_speech(translated, code)
+
+
+def flow_forex(recorder):
+    from expense_ledger import ExpenseLedger
+    from navigation.forex import get_exchange_rate, import_statement
+
+    with recorder.stage("forex.exchange_rate"):
+        get_exchange_rate("USD", "INR")
+    statement = "date,description,amount,currency\n" + "".join(
+        f"2023-05-{i % 28 + 1:02d},Taxi to hotel {i},{i % 90 + 10}.50,"
+        f"{('INR', 'EUR', 'THB')[i % 3]}\n"
+        for i in range(STATEMENT_ROWS)
+    )
+    ledger = ExpenseLedger()
+    with recorder.stage("forex.import_statement"):
+        import_statement(BytesIO(statement.encode("utf-8")), ledger)
+    with recorder.stage("forex.category_totals"):
+        ledger.category_totals("USD", get_exchange_rate)
+
+
+def clear_caches():
+    import image_helpers
+    import openai_client
+    import transcript_store
+    import tts_helpers
+
+    for cache in (
+        openai_client.get_cache(),
+        image_helpers.get_cache(),
+        tts_helpers.get_cache(),
+        transcript_store.get_store(),
+    ):
+        cache.clear()
+    if "navigation.youtube" in sys.modules:
+        sys.modules["navigation.youtube"]._artifact_cache.clear()
+
+
+def print_report(rows):
+    columns = ["n", "mean"] + [f"p{p}" for p in PERCENTILES] + ["max"]
+    print(f"{'stage':<46}" + "".join(f"{column:>10}" for column in columns))
+    for name, row in rows.items():
+        cells = [f"{row['n']:>10}"] + [
+            f"{row[column]:>10.1f}" for column in columns[1:]
+        ]
+        print(f"{name:<46}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--warm", action="store_true", help="keep caches between runs")
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=FLOWS)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = StandInServer(latency_scale=args.latency_scale, jitter=args.jitter)
+    server.start()
+    # The app reads its endpoints and cache paths at import time
+    os.environ.update(server.environment())
+    os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+    os.chdir(ROOT)
+
+    recorder = Recorder()
+    failures = {}
+    flows = {name: globals()[f"flow_{name}"] for name in args.flows}
+    try:
+        for _ in range(args.iterations):
+            if not args.warm:
+                clear_caches()
+            for name, flow in flows.items():
+                if name in failures:
+                    continue
+                try:
+                    with recorder.stage(f"{name} (total)"):
+                        flow(recorder)
+                except Exception as exc:
+                    failures[name] = f"{exc.__class__.__name__}: {exc}"
+    finally:
+        server.stop()
+
+    rows = recorder.report()
+    print_report(rows)
+    for name, error in failures.items():
+        print(f"FAILED {name}: {error}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"stages": rows, "failures": failures}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
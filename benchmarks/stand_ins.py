@@ -0,0 +1,307 @@
+"""Local stand-ins for the external APIs the app calls.
+
+One threaded HTTP server answers the OpenAI chat-completions and audio
+transcription endpoints, Unsplash search and photo downloads, the
+Text-to-Speech REST API and an exchange-rate API with canned but
+well-formed responses, after a configurable latency with jitter.
+
+    python benchmarks/stand_ins.py [--port 8765] [--latency-scale 1.0]
+
+prints the environment variables that point the app at it.
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+# Mean response latency per endpoint in milliseconds, roughly what the real
+# services take from a European data centre
+ENDPOINT_LATENCY_MS = {
+    "chat": 600,
+    "transcription": 2500,
+    "unsplash_search": 180,
+    "unsplash_photo": 90,
+    "tts": 250,
+    "forex": 120,
+}
+# Delay between streamed chat chunks, in milliseconds
+STREAM_CHUNK_MS = 10
+
+# Euro reference rates; other bases are derived from these
+EUR_RATES = {
+    "EUR": 1.0,
+    "USD": 1.08,
+    "GBP": 0.86,
+    "INR": 89.5,
+    "JPY": 161.0,
+    "CHF": 0.97,
+    "THB": 38.9,
+    "AUD": 1.64,
+}
+
+TRANSCRIPT_SENTENCES = [
+    "We landed in Paris early in the morning and took the train into the city.",
+    "Our first stop was the Louvre Museum where we spent about three hours.",
+    "In the afternoon we walked along the Seine to Notre Dame.",
+    "The next day we climbed the Eiffel Tower before the crowds arrived.",
+    "We had lunch at a small bistro in Montmartre near Sacre Coeur.",
+    "On day three we took a day trip to the Palace of Versailles.",
+    "In the evening we watched the sunset from the Pont des Arts.",
+]
+
+ITINERARY = "\n".join(
+    [
+        "Day 1:",
+        "09:00 - Louvre Museum",
+        "13:00 - Lunch in Le Marais",
+        "16:00 - Walk along the Seine to Notre Dame",
+        "Day 2:",
+        "08:30 - Eiffel Tower",
+        "12:30 - Lunch in Montmartre",
+        "15:00 - Sacre Coeur",
+        "Day 3:",
+        "09:00 - Palace of Versailles",
+        "19:00 - Sunset at the Pont des Arts",
+    ]
+)
+LOCATIONS = [
+    "Louvre Museum",
+    "Le Marais",
+    "Notre Dame",
+    "Eiffel Tower",
+    "Montmartre",
+    "Sacre Coeur",
+    "Palace of Versailles",
+    "Pont des Arts",
+]
+PHRASEBOOK = "\n".join(
+    [
+        "Hello: Bonjour",
+        "Goodbye: Au revoir",
+        "Please: S'il vous plait",
+        "Thank you: Merci",
+        "Excuse me: Excusez-moi",
+        "How much is this?: Combien ca coute ?",
+        "Where is the station?: Ou est la gare ?",
+    ]
+)
+EMERGENCY_DETAILS = "\n".join(
+    [
+        "Hopital Hotel-Dieu: 1 Parvis Notre-Dame, +33 1 42 34 82 34",
+        "Tourist police: +33 1 53 71 53 71",
+        "Poison control: +33 1 40 05 48 48",
+    ]
+)
+
+JSON_ARRAY = re.compile(r"\[.*\]\s*$", re.DOTALL)
+
+
+def chat_reply(prompt):
+    """A canned answer shaped like what the app expects for ``prompt``."""
+    if "JSON array" in prompt:
+        phrases = json.loads(JSON_ARRAY.search(prompt).group(0))
+        return json.dumps(
+            [{"translation": f"~{phrase}~", "latin": phrase} for phrase in phrases]
+        )
+    if "list the locations" in prompt:
+        return "\n".join(LOCATIONS)
+    if "What language is spoken" in prompt:
+        return "French"
+    if "common phrases" in prompt:
+        return PHRASEBOOK
+    if "emergency" in prompt:
+        return EMERGENCY_DETAILS
+    if "List every place" in prompt:
+        return "\n".join(f"- {location}" for location in LOCATIONS)
+    if "itinerary" in prompt:
+        return ITINERARY
+    return "The itinerary covers the main sights; start early to avoid queues."
+
+
+def transcript_text(words):
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentences.append(
+            TRANSCRIPT_SENTENCES[len(sentences) % len(TRANSCRIPT_SENTENCES)]
+        )
+    return " ".join(sentences)
+
+
+def make_photo(size=(1080, 720)):
+    from PIL import Image
+
+    image = Image.new("RGB", size)
+    pixels = image.load()
+    for x in range(0, size[0], 4):
+        for y in range(0, size[1], 4):
+            pixels[x, y] = (x % 256, y % 256, (x + y) % 256)
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay(self, endpoint):
+        mean = ENDPOINT_LATENCY_MS[endpoint] * self.server.latency_scale / 1000
+        delay = random.gauss(mean, mean * self.server.jitter)
+        time.sleep(max(delay, 0))
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/search/photos":
+            self._delay("unsplash_search")
+            slug = re.sub(r"\W+", "-", query.get("query", ["photo"])[0].lower())
+            photo = f"http://{self.headers['Host']}/photos/{slug}.jpg"
+            self._send(200, {"results": [{"urls": {"small": photo}}]})
+        elif url.path.startswith("/photos/"):
+            self._delay("unsplash_photo")
+            self._send(200, self.server.photo, "image/jpeg")
+        elif url.path == "/latest":
+            self._delay("forex")
+            base = query.get("base", ["EUR"])[0]
+            if base not in EUR_RATES:
+                self._send(404, {"error": f"unknown base {base}"})
+                return
+            rates = {
+                currency: rate / EUR_RATES[base] for currency, rate in EUR_RATES.items()
+            }
+            self._send(200, {"base": base, "rates": rates})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path == "/v1/chat/completions":
+            self._chat(json.loads(body))
+        elif url.path == "/v1/audio/transcriptions":
+            self._delay("transcription")
+            text = transcript_text(self.server.transcript_words)
+            duration = len(text.split()) / 2.5
+            self._send(
+                200,
+                {
+                    "text": text,
+                    "segments": [{"start": 0.0, "end": duration, "text": text}],
+                    "duration": duration,
+                    "language": "english",
+                },
+            )
+        elif url.path == "/v1/text:synthesize":
+            self._delay("tts")
+            text = json.loads(body)["input"]["text"]
+            audio = b"ID3" + bytes(64 * len(text))
+            self._send(200, {"audioContent": base64.b64encode(audio).decode()})
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def _chat(self, data):
+        prompt = "\n".join(message["content"] for message in data["messages"])
+        reply = chat_reply(prompt)
+        prompt_tokens = len(prompt.split())
+        completion_tokens = len(reply.split())
+        self._delay("chat")
+        if not data.get("stream"):
+            self._send(
+                200,
+                {
+                    "choices": [{"message": {"role": "assistant", "content": reply}}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for piece in re.findall(r"\S+\s*", reply):
+            chunk = {"choices": [{"delta": {"content": piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(STREAM_CHUNK_MS / 1000)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_scale=1.0, jitter=0.2, transcript_words=4000):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.transcript_words = transcript_words
+        self.photo = make_photo()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def environment(self):
+        """Environment variables that route the app to this server."""
+        return {
+            "OPENAI_API_BASE": f"{self.url}/v1",
+            "OPEN_AI_API": "stand-in",
+            "UNSPLASH_API_BASE": self.url,
+            "UNSPLASH_API_KEY": "stand-in",
+            "TTS_API_ENDPOINT": self.url,
+            "FOREX_API_BASE": self.url,
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.latency_scale, args.jitter)
+    for name, value in server.environment().items():
+        print(f"export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
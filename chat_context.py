@@ -0,0 +1,139 @@
+import re
+
+from metrics import traced
+from openai_client import (
+    CONTEXT_TOKENS,
+    PROMPT_OVERHEAD_TOKENS,
+    complete_prompt,
+    count_tokens,
+    split_by_tokens,
+)
+
+# Prompt budget for the itinerary chat. The whole prompt must leave room for
+# the answer in gpt-3.5-turbo's context window. Recent question/answer pairs
+# are sent verbatim; older ones are folded into a rolling summary, in batches
+# of FOLD_TURNS or sooner when the verbatim turns outgrow their budget
+ANSWER_MAX_TOKENS = 1024
+PROMPT_TOKEN_BUDGET = CONTEXT_TOKENS - ANSWER_MAX_TOKENS - PROMPT_OVERHEAD_TOKENS
+RECENT_TURNS = 3
+FOLD_TURNS = 3
+HISTORY_TOKEN_BUDGET = 1200
+SUMMARY_MAX_TOKENS = 200
+# Itineraries run up to ~1000 tokens; a long one is cut to the relevant days.
+# The itinerary gets at least this much, and whatever the history leaves over
+ITINERARY_TOKEN_BUDGET = 600
+
+DAY_HEADER_PATTERN = re.compile(r"^\s*\**\s*day\s*(\d+)", re.IGNORECASE)
+DAY_MENTION_PATTERN = re.compile(r"\bday\s*(\d+)\b", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[a-z]{4,}")
+
+
+def split_itinerary_days(itinerary):
+    """Split an itinerary into (day number, text) sections; text before the
+    first day header is returned with day number None."""
+    sections = []
+    day, lines = None, []
+    for line in itinerary.split("\n"):
+        match = DAY_HEADER_PATTERN.match(line)
+        if match:
+            if lines:
+                sections.append((day, "\n".join(lines)))
+            day, lines = int(match.group(1)), []
+        lines.append(line)
+    if lines:
+        sections.append((day, "\n".join(lines)))
+    return sections
+
+
+def select_relevant_days(itinerary, question, budget=ITINERARY_TOKEN_BUDGET):
+    """Return the parts of ``itinerary`` most relevant to ``question`` that fit
+    in ``budget`` tokens, in their original order. When the most relevant
+    part alone is over budget, it is cut to the budget instead."""
+    if count_tokens(itinerary) <= budget:
+        return itinerary
+    if budget <= 0:
+        return ""
+
+    sections = split_itinerary_days(itinerary)
+    mentioned_days = {int(day) for day in DAY_MENTION_PATTERN.findall(question)}
+    question_words = set(WORD_PATTERN.findall(question.lower()))
+
+    def score(section):
+        day, text = section
+        if day in mentioned_days:
+            return float("inf")
+        return len(question_words & set(WORD_PATTERN.findall(text.lower())))
+
+    ranked = sorted(range(len(sections)), key=lambda i: (-score(sections[i]), i))
+    best = sections[ranked[0]][1]
+    if count_tokens(best) > budget:
+        return split_by_tokens(best, budget)[0]
+    selected, used = set(), 0
+    for i in ranked:
+        tokens = count_tokens(sections[i][1])
+        if used + tokens > budget:
+            continue
+        selected.add(i)
+        used += tokens
+    return "\n".join(sections[i][1] for i in sorted(selected))
+
+
+def format_turn(question, answer):
+    return f"User: {question}\ngpt-3.5-turbo: {answer}\n"
+
+
+class ChatContext:
+    """Keeps the itinerary chat prompt within PROMPT_TOKEN_BUDGET as the
+    conversation grows."""
+
+    def __init__(self):
+        self.summary = ""
+        self.turns = []
+
+    def add_turn(self, question, answer):
+        self.turns.append((question, answer))
+        fold = FOLD_TURNS if len(self.turns) >= RECENT_TURNS + FOLD_TURNS else 0
+        # Fold more of the oldest turns while the rest exceed their budget,
+        # always keeping the latest turn verbatim
+        sizes = [count_tokens(format_turn(*turn)) for turn in self.turns]
+        while fold < len(self.turns) - 1 and sum(sizes[fold:]) > HISTORY_TOKEN_BUDGET:
+            fold += 1
+        if fold:
+            self._fold(self.turns[:fold])
+            self.turns = self.turns[fold:]
+
+    @traced()
+    def _fold(self, turns):
+        conversation = "".join(format_turn(*turn) for turn in turns)
+        prompt = f"Update the summary of a conversation about a travel itinerary with the new turns below. Keep the user's preferences, decisions and open questions; drop small talk. Answer with the updated summary only.\n\nCurrent summary: {self.summary or 'None'}\n\nNew turns:\n{conversation}\nUpdated summary:"
+        self.summary = complete_prompt(
+            prompt, max_tokens=SUMMARY_MAX_TOKENS, temperature=0.2
+        )
+
+    def build_prompt(self, itinerary, question):
+        summary = (
+            f"Summary of our earlier conversation: {self.summary}\n\n"
+            if self.summary
+            else ""
+        )
+        ending = f"User: {question}\ngpt-3.5-turbo:"
+        remaining = PROMPT_TOKEN_BUDGET - count_tokens(summary + ending)
+
+        # The itinerary may use whatever the verbatim turns do not need
+        history_tokens = sum(count_tokens(format_turn(*turn)) for turn in self.turns)
+        budget = remaining - count_tokens("My travel itinerary is\n\n\n")
+        budget = min(budget, max(ITINERARY_TOKEN_BUDGET, budget - history_tokens))
+        itinerary = select_relevant_days(itinerary, question, max(0, budget))
+        header = f"My travel itinerary is\n{itinerary}\n\n"
+        remaining -= count_tokens(header)
+
+        # The newest verbatim turns that still fit, oldest of them first
+        history = []
+        for turn in reversed(self.turns):
+            text = format_turn(*turn)
+            tokens = count_tokens(text)
+            if tokens > remaining:
+                break
+            history.insert(0, text)
+            remaining -= tokens
+        return header + summary + "".join(history) + ending
@@ -1,79 +1,152 @@
+import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
-import openai
-import requests
 import streamlit as st
-from googletrans import LANGUAGES, Translator
-from pydub import AudioSegment
-from pytube import YouTube
 
-openai.api_key = os.environ.get("OPEN_AI_API")
+from admission_control import BULK, INTERACTIVE
+from locale_index import language_code
+from metrics import span, traced
+from openai_client import (
+    CONTEXT_TOKENS,
+    PROMPT_OVERHEAD_TOKENS,
+    chat_completion,
+    complete_prompt,
+    count_tokens,
+    split_by_tokens,
+    stream_chat_completion,
+    transcribe,
+)
+
+
+# How long cached LLM answers stay valid, in seconds
+TRANSLATION_CACHE_TTL = 30 * 24 * 60 * 60
+ITINERARY_CACHE_TTL = 24 * 60 * 60
+
+# Short tracks go to Whisper in one upload. Longer ones are cut into
+# segments of at most SEGMENT_MS, at a silence close to each boundary, which
+# are transcoded to low-bitrate mono and transcribed in parallel
+SINGLE_UPLOAD_BYTES = 4 * 1024 * 1024
+SEGMENT_MS = 5 * 60 * 1000
+SILENCE_SEARCH_MS = 20 * 1000
+MIN_SILENCE_MS = 400
+SILENCE_BELOW_AVERAGE_DB = 16
+TRANSCODE_BITRATE = "32k"
+TRANSCODE_FRAME_RATE = 16000
+TRANSCRIBE_WORKERS = 4
+
+# gpt-3.5-turbo has a 4,096-token context. Transcripts above
+# TRANSCRIPT_TOKEN_LIMIT are condensed chunk by chunk (map) before the
+# itinerary prompt (reduce)
+TRANSCRIPT_TOKEN_LIMIT = 2500
+TRANSCRIPT_CHUNK_TOKENS = 2000
+NOTES_MAX_TOKENS = 400
+MAP_WORKERS = 4
+
+# Batch translation: phrases per request, and requests in flight
+TRANSLATION_BATCH_SIZE = 20
+TRANSLATION_WORKERS = 4
+# Completion budget per request. Native script plus transliteration of a
+# non-Latin language takes several times the English token count, and each
+# phrase adds its JSON keys; the budget doubles on the retry
+TRANSLATION_TOKENS_PER_INPUT_TOKEN = 8
+TRANSLATION_TOKENS_PER_PHRASE = 24
+TRANSLATION_MIN_TOKENS = 256
+JSON_ARRAY_PATTERN = re.compile(r"\[.*\]", re.DOTALL)
 
 
 def get_language_code(language_name):
-    for code, name in LANGUAGES.items():
-        if name.lower() == language_name.lower():
-            return code
-    return None
-
-
-def translate_latin_text(input_text, target_language):
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
+    return language_code(language_name)
+
+
+def parse_translations(content, count):
+    """Parse and validate the JSON array returned for a translation batch."""
+    match = JSON_ARRAY_PATTERN.search(content)
+    if match is None:
+        raise ValueError("Translation response contains no JSON array")
+    items = json.loads(match.group(0))
+    if not isinstance(items, list) or len(items) != count:
+        raise ValueError(f"Expected a list of {count} translations, got {items!r}")
+    for item in items:
+        if not isinstance(item, dict) or not all(
+            isinstance(item.get(key), str) and item[key].strip()
+            for key in ("translation", "latin")
+        ):
+            raise ValueError(f"Malformed translation item: {item!r}")
+    return [
+        {"translation": item["translation"].strip(), "latin": item["latin"].strip()}
+        for item in items
+    ]
+
+
+@traced()
+def _translate_chunk(texts, target_language):
     prompt = (
-        f"Translate the following English text to {target_language} and write the text in Latin script and not in target language. "
-        f"Please provide the LATIN TEXT of the translation on a separate line with the header 'Latin Script:'.\n\n"
-        f"{input_text}"
+        f"Translate each English phrase in the JSON array below to {target_language}. "
+        f"Respond with only a JSON array containing one object per phrase, in the same order, "
+        f'with the keys "translation" (the {target_language} text in its native script) and '
+        f'"latin" (the same translation transliterated into Latin script).\n\n'
+        f"{json.dumps(texts, ensure_ascii=False)}"
     )
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 0.5,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
+    input_tokens = count_tokens(json.dumps(texts, ensure_ascii=False))
+    max_tokens = max(
+        TRANSLATION_MIN_TOKENS,
+        TRANSLATION_TOKENS_PER_INPUT_TOKEN * input_tokens
+        + TRANSLATION_TOKENS_PER_PHRASE * len(texts),
     )
-    response_json = response.json()
-
-    translated_message = response_json["choices"][0]["message"]["content"].strip()
+    # Never ask for more than the context has left after the prompt
+    token_limit = CONTEXT_TOKENS - count_tokens(prompt) - PROMPT_OVERHEAD_TOKENS
+    kwargs = {
+        "temperature": 0.3,
+        "cache_ttl": TRANSLATION_CACHE_TTL,
+        "validate": lambda content: parse_translations(content, len(texts)),
+    }
+    try:
+        content = complete_prompt(
+            prompt, max_tokens=min(max_tokens, token_limit), **kwargs
+        )
+    except ValueError:
+        # One retry for a malformed or truncated answer, with more room;
+        # rejected answers are never cached
+        content = complete_prompt(
+            prompt, max_tokens=min(2 * max_tokens, token_limit), **kwargs
+        )
+    return parse_translations(content, len(texts))
+
+
+@traced()
+def translate_batch(texts, target_language, max_workers=TRANSLATION_WORKERS):
+    """Translate many English phrases to ``target_language``.
+
+    Phrases are sent TRANSLATION_BATCH_SIZE at a time in one structured
+    request each, with the requests running concurrently. Returns a list of
+    {"translation", "latin"} dicts in input order.
+    """
+    unique = list(dict.fromkeys(texts))
+    if not unique:
+        return []
+    chunks = [
+        unique[i : i + TRANSLATION_BATCH_SIZE]
+        for i in range(0, len(unique), TRANSLATION_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        results = pool.map(
+            lambda chunk: _translate_chunk(chunk, target_language), chunks
+        )
+        translations = dict(zip(unique, (item for chunk in results for item in chunk)))
+    return [translations[text] for text in texts]
 
-    # Extract the translated text
-    translated_text = translated_message.split("\n")[0]
 
-    return translated_text
+def translate_latin_text(input_text, target_language):
+    return translate_batch([input_text], target_language)[0]["latin"]
 
 
 def translate_text(input_text, target_language):
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-    prompt = (
-        f"Translate the following English text to {target_language} and also write the text in Latin script. "
-        f"Please provide the translation on a separate line with the header '{target_language}:', followed by a line break, and then the Latin script on the next line with the header 'Latin Script:'.\n\n"
-        f"{input_text}"
-    )
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 1,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
-    )
-    response_json = response.json()
-
-    translated_message = response_json["choices"][0]["message"]["content"].strip()
-
-    # Extract the translated text
-    translated_text = translated_message.split("\n")[0]
-    translated_text_latin = translated_message.split("\n")[1]
+    translation = translate_batch([input_text], target_language)[0]
+    translated_text = translation["translation"]
+    translated_text_latin = translation["latin"]
 
     # Get the target language code
     target_language_code = get_language_code(target_language)
@@ -81,86 +154,175 @@ def translate_text(input_text, target_language):
     return translated_text, translated_text_latin, target_language_code
 
 
+@traced()
 def download_audio(yt_url):
+    """Download the smallest mp4 audio stream of a video into memory.
+
+    The mp4 container is accepted by Whisper as is, so short tracks are
+    uploaded without any transcode.
+    """
+    # pytube and pydub are only needed by the YouTube page, so they are
+    # imported on first use to keep the other pages' cold start small
+    from pytube import YouTube
+
     yt = YouTube(yt_url)
-    audio_stream = yt.streams.filter(only_audio=True, file_extension="mp4").first()
-    audio_file = audio_stream.download(filename="temp_audio")
-    mp4_audio = AudioSegment.from_file(audio_file, format="mp4")
-    mp3_file = "temp_audio.mp3"
-    mp4_audio.export(mp3_file, format="mp3")
-    os.remove(audio_file)
-    return mp3_file
+    audio_stream = (
+        yt.streams.filter(only_audio=True, file_extension="mp4").order_by("abr").first()
+    )
+    audio_file = BytesIO()
+    audio_stream.stream_to_buffer(audio_file)
+    audio_file.seek(0)
+    audio_file.name = "audio.mp4"
+    return audio_file
 
 
+@traced()
 def chat_with_gpt(itinerary, user_question):
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
     prompt = f"The following is a travel itinerary:\n\n{itinerary}\n\nUser: {user_question}\n\nAssistant:"
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 0.6,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
+    return complete_prompt(prompt, temperature=0.6)
+
+
+@traced()
+def extract_travel_notes(transcript_chunk):
+    prompt = f"The following is part of a travel vlog transcript from a youtube video. List every place, activity, and time or duration mentioned in it as short bullet points, in the order they appear. Only include facts from the transcript.\n\nTranscript: {transcript_chunk}\n\nNotes:"
+    return complete_prompt(
+        prompt,
+        max_tokens=NOTES_MAX_TOKENS,
+        temperature=0.2,
+        cache_ttl=ITINERARY_CACHE_TTL,
+        priority=BULK,
     )
-    response_json = response.json()
 
-    return response_json["choices"][0]["message"]["content"].strip()
 
+@traced()
+def condense_transcript(transcript, max_workers=MAP_WORKERS):
+    """Map step: turn a transcript that does not fit the context into compact
+    travel notes, extracting each chunk concurrently."""
+    while count_tokens(transcript) > TRANSCRIPT_TOKEN_LIMIT:
+        chunks = split_by_tokens(transcript, TRANSCRIPT_CHUNK_TOKENS)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+            transcript = "\n".join(pool.map(extract_travel_notes, chunks))
+    return transcript
 
-def generate_itinerary_by_youtube(transcript, days):
-    transcript_data = transcript
-    prompt = f"Based on the following information from the travel vlog transcript which is obtained from a youtube video, create a very detailed {days}-day travel itinerary with time stamp.\n\n Youtube Video Transcript: {transcript_data}\n\nItinerary:"
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 0.6,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
-    )
-    response_json = response.json()
 
-    return response_json["choices"][0]["message"]["content"].strip()
+@traced()
+def generate_itinerary_by_youtube(transcript, days, stream=False):
+    transcript_data = condense_transcript(transcript)
+    prompt = f"Based on the following information from the travel vlog transcript which is obtained from a youtube video, create a very detailed {days}-day travel itinerary with time stamp.\n\n Youtube Video Transcript: {transcript_data}\n\nItinerary:"
+    if stream:
+        return stream_chat_completion(
+            [{"role": "system", "content": prompt}], temperature=0.6
+        )
+    return complete_prompt(prompt, temperature=0.6)
 
 
+@traced()
 def generate_itinerary_by_user_specs(city, days):
     prompt = f"Create a detailed {days}-day travel itinerary with time for a trip to {city}. Include various attractions, activities, and places to visit that are popular in the city.\n\nItinerary:"
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 0.6,
+    return complete_prompt(prompt, temperature=0.6, cache_ttl=ITINERARY_CACHE_TTL)
+
+
+def find_segment_bounds(audio, segment_ms=SEGMENT_MS):
+    """Split ``audio`` into (start_ms, end_ms) spans no longer than ``segment_ms``,
+    cutting at the last silence before each boundary when there is one."""
+    from pydub.silence import detect_silence
+
+    silence_thresh = audio.dBFS - SILENCE_BELOW_AVERAGE_DB
+    bounds = []
+    start = 0
+    while len(audio) - start > segment_ms:
+        target = start + segment_ms
+        window_start = max(start + 1, target - SILENCE_SEARCH_MS)
+        silences = detect_silence(
+            audio[window_start:target],
+            min_silence_len=MIN_SILENCE_MS,
+            silence_thresh=silence_thresh,
+        )
+        if silences:
+            silence_start, silence_end = silences[-1]
+            cut = window_start + (silence_start + silence_end) // 2
+        else:
+            cut = target
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, len(audio)))
+    return bounds
+
+
+def _transcribe_bytes(data, filename, offset=0.0):
+    result = transcribe(data, filename)
+    segments = [
+        {
+            "start": segment["start"] + offset,
+            "end": segment["end"] + offset,
+            "text": segment["text"],
+        }
+        for segment in result.get("segments", [])
+    ]
+    return result["text"].strip(), segments, result.get("language")
+
+
+@traced()
+def _transcribe_segment(audio, start_ms, end_ms):
+    segment_file = BytesIO()
+    audio[start_ms:end_ms].export(segment_file, format="mp3", bitrate=TRANSCODE_BITRATE)
+    return _transcribe_bytes(segment_file.getvalue(), "segment.mp3", start_ms / 1000)
+
+
+@traced()
+def transcribe_audio_detailed(
+    audio_file, max_workers=TRANSCRIBE_WORKERS, progress=None
+):
+    """Transcribe a path or file object with Whisper.
+
+    Returns a dict with the transcript ``text``, timestamped ``segments``,
+    the ``duration`` in seconds and the detected ``language``. ``progress``,
+    if given, is called with ``(segments_done, segments_total)``.
+    """
+    if isinstance(audio_file, str):
+        filename = os.path.basename(audio_file)
+        with open(audio_file, "rb") as audio:
+            data = audio.read()
+    else:
+        filename = os.path.basename(getattr(audio_file, "name", "audio.mp4"))
+        audio_file.seek(0)
+        data = audio_file.read()
+
+    if len(data) <= SINGLE_UPLOAD_BYTES:
+        results = [_transcribe_bytes(data, filename)]
+        if progress:
+            progress(1, 1)
+        duration = results[0][1][-1]["end"] if results[0][1] else 0.0
+    else:
+        audio_format = os.path.splitext(filename)[1].lstrip(".") or None
+        from pydub import AudioSegment
+
+        with span("core_helpers.transcode"):
+            audio = AudioSegment.from_file(BytesIO(data), format=audio_format)
+            audio = audio.set_channels(1).set_frame_rate(TRANSCODE_FRAME_RATE)
+            bounds = find_segment_bounds(audio)
+        # pool.map keeps the partial transcripts in segment order
+        results = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(bounds))) as pool:
+            for result in pool.map(
+                lambda segment: _transcribe_segment(audio, *segment), bounds
+            ):
+                results.append(result)
+                if progress:
+                    progress(len(results), len(bounds))
+        duration = len(audio) / 1000
+
+    return {
+        "text": " ".join(text for text, _, _ in results if text),
+        "segments": [segment for _, segments, _ in results for segment in segments],
+        "duration": duration,
+        "language": results[0][2],
     }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
-    )
-    response_json = response.json()
-
-    return response_json["choices"][0]["message"]["content"].strip()
 
 
 # Define function to transcribe audio using OpenAI API
 def transcribe_audio(audio_file):
-    with open(audio_file, "rb") as audio:
-        response = openai.Audio.transcribe("whisper-1", audio)
-        return response["text"]
+    return transcribe_audio_detailed(audio_file)["text"]
 
 
 def render_conversation(qa, role):
@@ -184,16 +346,25 @@ def render_conversation(qa, role):
         )
 
 
-def get_gpt_answer(prompt):
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=1024,
-        n=1,
-        stop=None,
-        temperature=0.6,
+def get_gpt_answer(prompt, stream=False, priority=INTERACTIVE):
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt},
+    ]
+    if stream:
+        return stream_chat_completion(
+            messages, max_tokens=1024, temperature=0.6, priority=priority
+        )
+    return chat_completion(
+        messages, max_tokens=1024, temperature=0.6, priority=priority
     )
-    return response.choices[0].message["content"].strip()
+
+
+def render_stream(tokens, placeholder):
+    """Render streamed tokens into ``placeholder`` as they arrive; return the text."""
+    text = ""
+    for token in tokens:
+        text += token
+        placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+    return text.strip()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache")
+
+
+def make_key(*parts):
+    """Content-address a cache entry by hashing its JSON-serialisable parts."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """SQLite-backed key/value cache with per-entry TTLs and LRU eviction.
+
+    Values are bytes. The total size of stored values is kept under
+    ``max_bytes`` by evicting the least recently accessed entries, and the
+    file survives process and container restarts.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires REAL, accessed REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self._count(False)
+            return None
+        value, expires = row
+        if expires is not None and expires <= now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(False)
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self._count(True)
+        return bytes(value)
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, sqlite3.Binary(value), len(value), expires, now),
+        )
+        self._evict(conn, now)
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,)
+        )
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        rows = conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ).fetchall()
+        victims = []
+        for key, size in rows:
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def stats(self):
+        entries, total = (
+            self._connect()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": total,
+        }
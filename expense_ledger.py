@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+
+class ExpenseLedger:
+    """Columnar store of expenses with incrementally maintained totals.
+
+    Amounts are kept in the currency they were spent in. Per-(category,
+    currency) sums are updated on every append, so category and grand totals
+    in any home currency cost one rate lookup per currency instead of a pass
+    over the rows. ``version`` changes whenever the contents change.
+    """
+
+    def __init__(self, capacity=64):
+        self.names = []
+        self.categories = []
+        self.currencies = []
+        self._amounts = np.empty(capacity, dtype=np.float64)
+        self._currency_codes = np.empty(capacity, dtype=np.int32)
+        self._currency_index = {}
+        self._size = 0
+        self._totals = {}
+        self.version = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def amounts(self):
+        return self._amounts[: self._size]
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._amounts):
+            return
+        capacity = max(needed, 2 * len(self._amounts))
+        self._amounts = np.resize(self._amounts, capacity)
+        self._currency_codes = np.resize(self._currency_codes, capacity)
+
+    def _currency_code(self, currency):
+        if currency not in self._currency_index:
+            self._currency_index[currency] = len(self._currency_index)
+        return self._currency_index[currency]
+
+    def append(self, name, category, amount, currency):
+        self.extend([name], [category], [amount], [currency])
+
+    def extend(self, names, categories, amounts, currencies):
+        amounts = np.asarray(amounts, dtype=np.float64)
+        count = len(amounts)
+        if count == 0:
+            return
+        self._reserve(count)
+        start, end = self._size, self._size + count
+        self._amounts[start:end] = amounts
+        self._currency_codes[start:end] = [
+            self._currency_code(currency) for currency in currencies
+        ]
+        self.names.extend(names)
+        self.categories.extend(categories)
+        self.currencies.extend(currencies)
+        self._size = end
+
+        for category, currency, amount in zip(categories, currencies, amounts):
+            key = (category, currency)
+            self._totals[key] = self._totals.get(key, 0.0) + amount
+        self.version += 1
+
+    def clear(self):
+        # Keep counting up so a cleared ledger never reuses an earlier version
+        version = self.version
+        self.__init__()
+        self.version = version + 1
+
+    def _rates_to(self, home_currency, get_rate):
+        """Rate from every currency in the ledger to ``home_currency``, indexed
+        by currency code."""
+        rates = np.empty(len(self._currency_index), dtype=np.float64)
+        for currency, code in self._currency_index.items():
+            rates[code] = get_rate(currency, home_currency)
+        return rates
+
+    def home_amounts(self, home_currency, get_rate):
+        """Every expense converted to ``home_currency`` in one vectorized pass."""
+        rates = self._rates_to(home_currency, get_rate)
+        return self.amounts * rates[self._currency_codes[: self._size]]
+
+    def category_totals(self, home_currency, get_rate):
+        rates = self._rates_to(home_currency, get_rate)
+        totals = {}
+        for (category, currency), amount in self._totals.items():
+            rate = rates[self._currency_index[currency]]
+            totals[category] = totals.get(category, 0.0) + amount * rate
+        return totals
+
+    def total(self, home_currency, get_rate):
+        return sum(self.category_totals(home_currency, get_rate).values())
+
+    def to_frame(self, home_currency, get_rate):
+        return pd.DataFrame(
+            {
+                "Expense Name": self.names,
+                "Expense Category": self.categories,
+                "Currency": self.currencies,
+                "Expense": self.amounts,
+                f"Expense in {home_currency}": self.home_amounts(
+                    home_currency, get_rate
+                ),
+            }
+        )
@@ -0,0 +1,152 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from disk_cache import CACHE_DIR, DiskCache, make_key
+from metrics import traced
+from openai_client import REQUEST_TIMEOUT, get_session
+
+UNSPLASH_API_BASE = os.environ.get("UNSPLASH_API_BASE", "https://api.unsplash.com")
+UNSPLASH_CACHE_PATH = os.environ.get(
+    "UNSPLASH_CACHE_PATH", os.path.join(CACHE_DIR, "unsplash.sqlite3")
+)
+UNSPLASH_CACHE_MAX_BYTES = int(
+    os.environ.get("UNSPLASH_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+# Search results and photos rarely change; misses are retried sooner
+IMAGE_URL_TTL = 30 * 24 * 60 * 60
+IMAGE_MISS_TTL = 24 * 60 * 60
+IMAGE_BYTES_TTL = 30 * 24 * 60 * 60
+MAX_WORKERS = 8
+
+# PDF images are drawn at 270x200 points; keep 2x pixels for print sharpness
+PDF_IMAGE_SIZE = (270, 200)
+PDF_IMAGE_SCALE = 2
+PDF_JPEG_QUALITY = 70
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache(UNSPLASH_CACHE_PATH, UNSPLASH_CACHE_MAX_BYTES)
+    return _cache
+
+
+@traced()
+def get_unsplash_image(query, api_key):
+    key = make_key("unsplash-url", query.lower())
+    cached = get_cache().get(key)
+    if cached is not None:
+        return cached.decode("utf-8") or None
+
+    headers = {"Authorization": f"Client-ID {api_key}"}
+    params = {"query": query, "orientation": "landscape", "per_page": 1}
+    response = get_session().get(
+        f"{UNSPLASH_API_BASE}/search/photos",
+        headers=headers,
+        params=params,
+        timeout=REQUEST_TIMEOUT,
+    )
+
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    url = data["results"][0]["urls"]["small"] if data["results"] else None
+    if url:
+        get_cache().set(key, url.encode("utf-8"), ttl=IMAGE_URL_TTL)
+    else:
+        get_cache().set(key, b"", ttl=IMAGE_MISS_TTL)
+    return url
+
+
+@traced()
+def fetch_image(url):
+    """Return the bytes of the image at ``url``, downloading it at most once."""
+    key = make_key("unsplash-image", url)
+    cached = get_cache().get(key)
+    if cached is not None:
+        return cached
+
+    response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    get_cache().set(key, response.content, ttl=IMAGE_BYTES_TTL)
+    return response.content
+
+
+def _resolve(query, api_key, download):
+    url = get_unsplash_image(query, api_key)
+    if url and download:
+        try:
+            fetch_image(url)
+        except requests.RequestException:
+            pass
+    return url
+
+
+@traced()
+def resolve_images(queries, api_key, download=True, max_workers=MAX_WORKERS):
+    """Look up an Unsplash image URL for every query concurrently.
+
+    Duplicate queries are resolved once. With ``download`` the thumbnails
+    are fetched into the shared cache as well. Returns a dict mapping each
+    query to its URL, or None when nothing was found.
+    """
+    unique = list(dict.fromkeys(q for q in queries if q))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+        urls = pool.map(lambda q: _resolve(q, api_key, download), unique)
+        return dict(zip(unique, urls))
+
+
+@traced()
+def downscale_image(data, size, quality=PDF_JPEG_QUALITY):
+    """Resize image bytes to ``size`` pixels and recompress them as JPEG."""
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB").resize(size, Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _pdf_image(url, size, quality):
+    key = make_key("pdf-image", url, size, quality)
+    cached = get_cache().get(key)
+    if cached is not None:
+        return cached
+    try:
+        data = downscale_image(fetch_image(url), size, quality)
+    except (requests.RequestException, OSError):
+        return None
+    get_cache().set(key, data, ttl=IMAGE_BYTES_TTL)
+    return data
+
+
+@traced()
+def prefetch_pdf_images(
+    urls, size=PDF_IMAGE_SIZE, quality=PDF_JPEG_QUALITY, max_workers=MAX_WORKERS
+):
+    """Fetch, downscale and recompress every image for the PDF concurrently.
+
+    Returns a dict mapping each URL to an in-memory JPEG buffer; images that
+    could not be fetched or decoded are left out.
+    """
+    pixels = (size[0] * PDF_IMAGE_SCALE, size[1] * PDF_IMAGE_SCALE)
+    unique = list(dict.fromkeys(url for url in urls if url))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+        images = pool.map(lambda url: _pdf_image(url, pixels, quality), unique)
+        return {
+            url: BytesIO(data) for url, data in zip(unique, images) if data is not None
+        }
@@ -0,0 +1,135 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# Finished jobs stay pollable for this long, in seconds
+JOB_RESULT_TTL = 30 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """State of one background job. Workers update it through ``report``;
+    pages read it through ``snapshot``."""
+
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.status = QUEUED
+        self.stage = "Waiting for a worker"
+        self.progress = 0.0
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def report(self, stage=None, progress=None, partial=None):
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            if progress is not None:
+                self.progress = min(max(progress, 0.0), 1.0)
+            if partial is not None:
+                self.partial = partial
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            if status == DONE:
+                self.progress = 1.0
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": self.progress,
+                "partial": self.partial,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobQueue:
+    """Bounded worker pool for long-running jobs.
+
+    ``submit(key, function, *args)`` runs ``function(job, *args)`` on a
+    worker and returns the Job. While a job with the same key is queued or
+    running, submitting it again returns the existing job instead of
+    starting another run.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._result_ttl = result_ttl
+        self._jobs = {}
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        with self._lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            job = Job(f"job-{next(self._ids)}", key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+        self._pool.submit(self._run, job, function, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, function, args):
+        with job._lock:
+            job.status = RUNNING
+            job.stage = "Starting"
+        try:
+            result = function(job, *args)
+        except Exception as exc:
+            job._finish(FAILED, error=str(exc) or exc.__class__.__name__)
+        else:
+            job._finish(DONE, result=result)
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def _prune(self):
+        cutoff = time.time() - self._result_ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue shared by every session."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
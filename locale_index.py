@@ -0,0 +1,253 @@
+import bisect
+import json
+import os
+import re
+import threading
+import unicodedata
+
+import pycountry
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Names that pycountry spells differently from how travellers type them
+COUNTRY_ALIASES = {
+    "usa": "US",
+    "united states of america": "US",
+    "america": "US",
+    "uk": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+    "great britain": "GB",
+    "south korea": "KR",
+    "korea": "KR",
+    "russia": "RU",
+    "vietnam": "VN",
+    "laos": "LA",
+    "iran": "IR",
+    "syria": "SY",
+    "taiwan": "TW",
+    "bolivia": "BO",
+    "venezuela": "VE",
+    "tanzania": "TZ",
+    "moldova": "MD",
+    "czech republic": "CZ",
+    "holland": "NL",
+    "burma": "MM",
+    "turkey": "TR",
+    "uae": "AE",
+    "vatican": "VA",
+}
+
+# Minimum trigram similarity for a fuzzy place match to be trusted
+FUZZY_MIN_SCORE = 0.45
+# ISO 639 qualifiers such as "(macrolanguage)" or "(1453-)"
+PARENTHETICAL_PATTERN = re.compile(r"\s*\(.*\)")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize(name):
+    """Case-fold and collapse whitespace so lookups ignore formatting."""
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+def strip_accents(name):
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _load(name):
+    with open(os.path.join(DATA_DIR, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _add(table, name, value):
+    key = normalize(name)
+    table.setdefault(key, value)
+    table.setdefault(strip_accents(key), value)
+
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _build_place_index(cities, countries):
+    """Sorted names for prefix search and a trigram -> names inverted index
+    for typo-tolerant search over every city and country name."""
+    places = dict(countries)
+    places.update(cities)
+    names = sorted(places)
+    grams = {}
+    for name in names:
+        for gram in trigrams(name):
+            grams.setdefault(gram, []).append(name)
+    return {"places": places, "names": names, "trigrams": grams}
+
+
+def _build_index():
+    languages = {}
+    language_names = {}
+    for language in pycountry.languages:
+        code = getattr(language, "alpha_2", None) or language.alpha_3
+        for name in (language.name, getattr(language, "common_name", None)):
+            if name:
+                _add(languages, name, code)
+                # "Nepali (macrolanguage)" is looked up as plain "Nepali"
+                _add(languages, PARENTHETICAL_PATTERN.sub("", name), code)
+        _add(languages, code, code)
+        name = getattr(language, "common_name", None) or language.name
+        language_names.setdefault(code, PARENTHETICAL_PATTERN.sub("", name))
+    for alias, code in _load("language_aliases").items():
+        # Aliases are curated, so they win over the generic ISO 639 names
+        languages[normalize(alias)] = code
+        languages[strip_accents(normalize(alias))] = code
+        _add(languages, code, code)
+
+    countries = {}
+    for country in pycountry.countries:
+        for name in (
+            country.name,
+            getattr(country, "official_name", None),
+            getattr(country, "common_name", None),
+            country.alpha_2,
+            country.alpha_3,
+        ):
+            if name:
+                _add(countries, name, country.alpha_2)
+    for alias, code in COUNTRY_ALIASES.items():
+        _add(countries, alias, code)
+
+    cities = {}
+    for city, code in _load("cities").items():
+        _add(cities, city, code)
+
+    return {
+        "languages": languages,
+        "language_names": language_names,
+        "countries": countries,
+        "cities": cities,
+        "country_languages": _load("country_languages"),
+        "emergency_numbers": _load("emergency_numbers"),
+        "fuzzy": _build_place_index(cities, countries),
+    }
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _build_index()
+    return _index
+
+
+def language_code(language_name):
+    """Resolve a language name, alias or endonym ("Mandarin", "español") to a
+    BCP-47 code, or None when it is unknown."""
+    key = normalize(language_name)
+    languages = get_index()["languages"]
+    return languages.get(key) or languages.get(strip_accents(key))
+
+
+def language_name(code):
+    """English name of a BCP-47 code such as "fr" or "zh-CN"."""
+    names = get_index()["language_names"]
+    return names.get(code) or names.get(code.split("-")[0], code)
+
+
+def country_name(code):
+    country = pycountry.countries.get(alpha_2=code)
+    if country is None:
+        return code
+    return getattr(country, "common_name", None) or country.name
+
+
+def _lookup(key, tables):
+    index = get_index()
+    for candidate in (key, strip_accents(key)):
+        for table in tables:
+            if candidate in index[table]:
+                return index[table][candidate]
+    return None
+
+
+def _country_part(key):
+    parts = [part.strip() for part in key.split(",") if part.strip()]
+    return parts[-1] if parts else ""
+
+
+def resolve_country(place):
+    """Return the ISO 3166 alpha-2 code of a city or country name, or None.
+    In "Kyoto, Japan" style input the last, most general part decides, so
+    "Paris, Texas" is unknown rather than France."""
+    key = normalize(place)
+    country = _lookup(key, ("cities", "countries"))
+    if country or "," not in key:
+        return country
+    return _lookup(_country_part(key), ("countries", "cities"))
+
+
+def place_languages(place):
+    """BCP-47 codes of the main languages spoken in a city or country, most
+    widely used first; empty when the place is not in the index."""
+    country = resolve_country(place)
+    if country is None:
+        return []
+    return get_index()["country_languages"].get(country, [])
+
+
+def fuzzy_resolve_country(place, min_score=FUZZY_MIN_SCORE):
+    """Like resolve_country, but also accepts prefixes ("barcel") and typos
+    ("Amsterdm") by searching the prefix and trigram indexes."""
+    country = resolve_country(place)
+    if country:
+        return country
+    key = strip_accents(normalize(place))
+    if "," in key:
+        key = _country_part(key)
+    if len(key) < 3:
+        return None
+    fuzzy = get_index()["fuzzy"]
+
+    # Unambiguous prefix of a known name
+    names = fuzzy["names"]
+    start = bisect.bisect_left(names, key)
+    matches = set()
+    for name in names[start:]:
+        if not name.startswith(key):
+            break
+        matches.add(fuzzy["places"][name])
+    if len(matches) == 1:
+        return matches.pop()
+
+    # Best Jaccard similarity over shared trigrams
+    query = trigrams(key)
+    shared = {}
+    for gram in query:
+        for name in fuzzy["trigrams"].get(gram, ()):
+            shared[name] = shared.get(name, 0) + 1
+    best, best_score = None, min_score
+    for name, count in shared.items():
+        score = count / (len(query) + len(trigrams(name)) - count)
+        if score > best_score:
+            best, best_score = name, score
+    return fuzzy["places"][best] if best else None
+
+
+def emergency_numbers(place):
+    """National emergency numbers for a city or country as ``(country_code,
+    {"general", "police", "ambulance", "fire"})``, or ``(None, None)`` when
+    the place cannot be resolved or has no bundled numbers. A known city
+    given with another country ("Paris, Japan") is treated as unresolved."""
+    country = fuzzy_resolve_country(place)
+    if country and "," in place:
+        city_country = _lookup(normalize(place.split(",")[0]), ("cities",))
+        if city_country and city_country != country:
+            return None, None
+    numbers = get_index()["emergency_numbers"].get(country) if country else None
+    if numbers is None:
+        return None, None
+    return country, numbers
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Append every span and token record to this JSONL file when set
+METRICS_LOG_PATH = os.environ.get("METRICS_LOG_PATH")
+# Serve the metrics in Prometheus text format on this port when set
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
+# USD per 1K prompt and completion tokens, and per minute of Whisper audio
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+}
+AUDIO_PRICE_PER_MINUTE = {"whisper-1": 0.006}
+
+# Token usage outside of any span is reported under this name
+UNATTRIBUTED = "unattributed"
+
+_spans = {}
+_usage = {}
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+_local = threading.local()
+_server = None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def _log(record):
+    if not METRICS_LOG_PATH:
+        return
+    line = json.dumps({"time": time.time(), **record})
+    with _log_lock:
+        with open(METRICS_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def record_span(name, seconds, error=None, parent=None):
+    with _lock:
+        stats = _spans.setdefault(
+            name, {"count": 0, "seconds": 0.0, "max": 0.0, "errors": 0}
+        )
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        if error:
+            stats["errors"] += 1
+    _log(
+        {
+            "type": "span",
+            "name": name,
+            "parent": parent,
+            "seconds": seconds,
+            "error": error,
+        }
+    )
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as ``name``. Spans nest per thread, and token
+    usage recorded inside one is attributed to the innermost span."""
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as exc:
+        error = exc.__class__.__name__
+        raise
+    finally:
+        stack.pop()
+        record_span(name, time.perf_counter() - start, error, parent)
+
+
+def traced(name=None):
+    """Decorator form of ``span``; the span defaults to module.function."""
+
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _add_usage(model, prompt_tokens=0, completion_tokens=0, audio_seconds=0.0):
+    function = current_span() or UNATTRIBUTED
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    cost = (
+        prompt_tokens * prompt_price / 1000
+        + completion_tokens * completion_price / 1000
+        + audio_seconds / 60 * AUDIO_PRICE_PER_MINUTE.get(model, 0.0)
+    )
+    with _lock:
+        usage = _usage.setdefault(
+            (function, model),
+            {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "audio_seconds": 0.0,
+                "cost": 0.0,
+            },
+        )
+        usage["requests"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["audio_seconds"] += audio_seconds
+        usage["cost"] += cost
+    _log(
+        {
+            "type": "usage",
+            "function": function,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "audio_seconds": audio_seconds,
+            "cost": cost,
+        }
+    )
+
+
+def record_tokens(model, prompt_tokens, completion_tokens):
+    _add_usage(model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def record_audio(model, seconds):
+    _add_usage(model, audio_seconds=seconds)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "spans": {name: dict(stats) for name, stats in _spans.items()},
+            "usage": [
+                {"function": function, "model": model, **usage}
+                for (function, model), usage in _usage.items()
+            ],
+        }
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _usage.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _labels(**labels):
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def prometheus_text():
+    """Render the current metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = [
+        "# HELP app_span_seconds Time spent in each instrumented step.",
+        "# TYPE app_span_seconds summary",
+    ]
+    for name, stats in data["spans"].items():
+        lines.append(f"app_span_seconds_count{_labels(span=name)} {stats['count']}")
+        lines.append(f"app_span_seconds_sum{_labels(span=name)} {stats['seconds']}")
+    lines += ["# TYPE app_span_seconds_max gauge"]
+    for name, stats in data["spans"].items():
+        lines.append(f"app_span_seconds_max{_labels(span=name)} {stats['max']}")
+    lines += ["# TYPE app_span_errors_total counter"]
+    for name, stats in data["spans"].items():
+        lines.append(f"app_span_errors_total{_labels(span=name)} {stats['errors']}")
+
+    counters = [
+        ("app_llm_requests_total", "requests"),
+        ("app_llm_prompt_tokens_total", "prompt_tokens"),
+        ("app_llm_completion_tokens_total", "completion_tokens"),
+        ("app_llm_audio_seconds_total", "audio_seconds"),
+        ("app_llm_cost_usd_total", "cost"),
+    ]
+    for metric, field in counters:
+        lines.append(f"# TYPE {metric} counter")
+        for usage in data["usage"]:
+            labels = _labels(function=usage["function"], model=usage["model"])
+            lines.append(f"{metric}{labels} {usage[field]}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics and /metrics.json on ``port`` from a daemon thread;
+    does nothing without a port or when the server is already running."""
+    global _server
+    if not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
@@ -1,46 +1,90 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 
-import openai
-import requests
 import streamlit as st
 from dotenv import load_dotenv
 
+from locale_index import country_name, emergency_numbers
+from metrics import traced
+from openai_client import OpenAIClientError, complete_prompt
+
 load_dotenv()
 
-openai.api_key = os.environ.get("OPEN_AI_API")
 
 # GPT-3 model settings
 model_engine = "davinci"
 max_tokens = 60
 temperature = 0.8
 
+# How long cached emergency contacts stay valid, in seconds
+EMERGENCY_CACHE_TTL = 7 * 24 * 60 * 60
+
+NUMBER_LABELS = [
+    ("general", "General emergency"),
+    ("police", "Police"),
+    ("ambulance", "Ambulance"),
+    ("fire", "Fire"),
+]
+
+# Shared by all sessions; local details are fetched while the numbers render
+_executor = ThreadPoolExecutor(max_workers=4)
 
+
+@traced()
 def generate_emergency_contacts(city):
     prompt = f"Generate a list of emergency contacts for {city} "
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "temperature": 0.5,
-        "max_tokens": 1024,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
+    contacts = complete_prompt(prompt, temperature=0.5, cache_ttl=EMERGENCY_CACHE_TTL)
+    return contacts.split("\n")
+
+
+@traced()
+def generate_local_details(city, country):
+    prompt = (
+        f"List local emergency resources for a traveller in {city}, "
+        f"{country_name(country)}: "
+        "major hospitals, tourist police, poison control and other helplines. "
+        "Do not repeat the national police, ambulance or fire numbers."
     )
-    response_json = response.json()
+    contacts = complete_prompt(prompt, temperature=0.5, cache_ttl=EMERGENCY_CACHE_TTL)
+    return [contact for contact in contacts.split("\n") if contact.strip()]
+
 
-    return response_json["choices"][0]["message"]["content"].strip().split("\n")
+def render_numbers(city, country, numbers):
+    st.write(f"Emergency numbers for {city} ({country_name(country)}):")
+    for key, label in NUMBER_LABELS:
+        st.write(f"- {label}: **{numbers[key]}**")
 
 
 def emergency_contacts(city):
+    if not city:
+        return
+    country, numbers = emergency_numbers(city)
+    if numbers is None:
+        emergency_contacts_llm(city)
+        return
+
+    # Start the LLM call first so it runs while the bundled numbers render
+    details = _executor.submit(generate_local_details, city, country)
+    render_numbers(city, country, numbers)
+    with st.spinner("Looking up local emergency services..."):
+        try:
+            contacts = details.result()
+        except Exception:
+            st.warning("Local emergency services are unavailable right now.")
+            return
+    if contacts:
+        st.write("Local emergency services:")
+        for contact in contacts:
+            st.write(f"- {contact}")
+
+
+def emergency_contacts_llm(city):
     if city:
         # Retrieve the emergency contacts for the city
-        emergency_contacts = generate_emergency_contacts(city)
+        try:
+            emergency_contacts = generate_emergency_contacts(city)
+        except OpenAIClientError as e:
+            st.error(f"Could not look up emergency contacts: {e}")
+            return
 
         # Display the emergency contacts
         if emergency_contacts:
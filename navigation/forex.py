@@ -1,16 +1,47 @@
+import time
+from io import BytesIO
+
 import matplotlib.pyplot as plt
 import pandas as pd
 import pycountry
-import spacy
 import streamlit as st
-from forex_python.converter import CurrencyRates
 
-nlp = spacy.load("en_core_web_sm")
-c = CurrencyRates()
+from expense_ledger import ExpenseLedger
+from metrics import traced
+from rate_service import get_rate, get_rate_table
+
+_nlp = None
+
+# Statement imports are read in chunks of this many rows
+IMPORT_CHUNK_ROWS = 10000
+IMPORT_COLUMNS = ("date", "description", "amount", "currency")
+
+
+def get_nlp():
+    """Load the spaCy model once per process, the first time it is needed."""
+    global _nlp
+    if _nlp is None:
+        import spacy
+
+        _nlp = spacy.load("en_core_web_sm")
+    return _nlp
 
 
 def get_exchange_rate(from_currency, to_currency):
-    return c.get_rate(from_currency, to_currency)
+    return get_rate(from_currency, to_currency)
+
+
+def format_rates_age(table):
+    age = time.time() - table["fetched_at"]
+    if age < 60 * 60:
+        age_text = f"{int(age // 60)} min"
+    elif age < 48 * 60 * 60:
+        age_text = f"{int(age // 3600)} h"
+    else:
+        age_text = f"{int(age // 86400)} days"
+    return f"Exchange rates updated {age_text} ago" + (
+        " (offline snapshot, live rates unavailable)" if table["stale"] else ""
+    )
 
 
 def convert_expense(expense, from_currency, to_currency):
@@ -18,113 +49,223 @@ def convert_expense(expense, from_currency, to_currency):
     return expense * rate
 
 
-def categorize_expense(expense_name):
-    categories = {
-        "food": [
-            "restaurant",
-            "grocery",
-            "food",
-            "coffee",
-            "breakfast",
-            "lunch",
-            "dinner",
-            "snack",
-            "meal",
-            "cafe",
-            "local stall",
-            "bakery",
-            "bar",
-            "beverage",
-            "buffet",
-            "catering",
-            "chocolate",
-            "cocktail",
-            "deli",
-            "dessert",
-            "fast food",
-            "fish",
-            "grill",
-            "ice cream",
-            "pizza",
-            "pub",
-            "seafood",
-            "smoothie",
-            "sushi",
-            "tapas",
-            "tea",
-        ],
-        "travel": [
-            "hotel",
-            "flight",
-            "taxi",
-            "train",
-            "bus",
-            "car rental",
-            "transportation",
-            "parking",
-            "uber",
-            "transport",
-            "airport",
-            "cruise",
-            "rental car",
-            "road trip",
-            "tour",
-        ],
-        "accommodation": [
-            "hotel",
-            "hostel",
-            "motel",
-            "lodging",
-            "accommodation",
-            "airbnb",
-            "apartment",
-            "bed and breakfast",
-            "cabin",
-            "resort",
-            "villa",
-        ],
-        "shopping": [
-            "shopping",
-            "clothing",
-            "electronics",
-            "furniture",
-            "bookstore",
-            "supermarket",
-            "gifts",
-            "boutique",
-            "department store",
-            "jewelry",
-            "mall",
-            "market",
-            "outlet",
-            "shoes",
-            "sporting goods",
-            "toys",
-        ],
-        "miscellaneous": [
-            "miscellaneous",
-            "general",
-            "expense",
-            "others",
-            "fees",
-            "charges",
-            "insurance",
-            "internet",
-            "maintenance",
-            "subscription",
-            "utility",
-        ],
-    }
+EXPENSE_CATEGORIES = {
+    "food": [
+        "restaurant",
+        "grocery",
+        "food",
+        "coffee",
+        "breakfast",
+        "lunch",
+        "dinner",
+        "snack",
+        "meal",
+        "cafe",
+        "local stall",
+        "bakery",
+        "bar",
+        "beverage",
+        "buffet",
+        "catering",
+        "chocolate",
+        "cocktail",
+        "deli",
+        "dessert",
+        "fast food",
+        "fish",
+        "grill",
+        "ice cream",
+        "pizza",
+        "pub",
+        "seafood",
+        "smoothie",
+        "sushi",
+        "tapas",
+        "tea",
+    ],
+    "travel": [
+        "hotel",
+        "flight",
+        "taxi",
+        "train",
+        "bus",
+        "car rental",
+        "transportation",
+        "parking",
+        "uber",
+        "transport",
+        "airport",
+        "cruise",
+        "rental car",
+        "road trip",
+        "tour",
+    ],
+    "accommodation": [
+        "hotel",
+        "hostel",
+        "motel",
+        "lodging",
+        "accommodation",
+        "airbnb",
+        "apartment",
+        "bed and breakfast",
+        "cabin",
+        "resort",
+        "villa",
+    ],
+    "shopping": [
+        "shopping",
+        "clothing",
+        "electronics",
+        "furniture",
+        "bookstore",
+        "supermarket",
+        "gifts",
+        "boutique",
+        "department store",
+        "jewelry",
+        "mall",
+        "market",
+        "outlet",
+        "shoes",
+        "sporting goods",
+        "toys",
+    ],
+    "miscellaneous": [
+        "miscellaneous",
+        "general",
+        "expense",
+        "others",
+        "fees",
+        "charges",
+        "insurance",
+        "internet",
+        "maintenance",
+        "subscription",
+        "utility",
+    ],
+}
+
 
-    # Use SpaCy to categorize expense name
-    doc = nlp(expense_name.lower())
-    for token in doc:
-        for category, keywords in categories.items():
-            if token.text in keywords:
+def build_category_matcher(categories):
+    """Index category keywords once: single words map straight to their
+    category and multi-word phrases are grouped by their first word."""
+    words = {}
+    phrases = {}
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            tokens = tuple(keyword.split())
+            if len(tokens) == 1:
+                words.setdefault(tokens[0], category)
+            else:
+                phrases.setdefault(tokens[0], []).append((tokens, category))
+    for candidates in phrases.values():
+        candidates.sort(key=lambda candidate: -len(candidate[0]))
+    return words, phrases
+
+
+CATEGORY_WORDS, CATEGORY_PHRASES = build_category_matcher(EXPENSE_CATEGORIES)
+
+
+def match_category(tokens):
+    for i, token in enumerate(tokens):
+        for phrase, category in CATEGORY_PHRASES.get(token, ()):
+            if tuple(tokens[i : i + len(phrase)]) == phrase:
                 return category
+        if token in CATEGORY_WORDS:
+            return CATEGORY_WORDS[token]
     return "miscellaneous"
 
 
+@traced()
+def categorize_expenses(expense_names, batch_size=1000):
+    # Only the tokenizer is needed, so the tagger, parser and NER are skipped
+    docs = get_nlp().tokenizer.pipe(
+        (name.lower() for name in expense_names), batch_size=batch_size
+    )
+    return [match_category([token.text for token in doc]) for doc in docs]
+
+
+def categorize_expense(expense_name):
+    return categorize_expenses([expense_name])[0]
+
+
+@traced()
+def import_statement(statement_file, ledger, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Append the spending rows of a CSV statement export (date, description,
+    amount, currency) to ``ledger`` and return the number of rows imported.
+
+    Exports sign spending either way round, so the sign most rows share is
+    taken as spending and stored as a positive amount; payments and refunds
+    with the other sign are skipped. The whole file is validated before
+    anything is added, so a bad row never leaves a half-imported statement.
+    Each chunk is categorized in one batch.
+    """
+    reader = pd.read_csv(
+        statement_file,
+        chunksize=chunk_rows,
+        usecols=lambda column: column.strip().lower() in IMPORT_COLUMNS,
+        dtype=str,
+    )
+    chunks = []
+    for chunk in reader:
+        chunk.columns = [column.strip().lower() for column in chunk.columns]
+        missing = {"description", "amount", "currency"} - set(chunk.columns)
+        if missing:
+            raise ValueError(f"Statement is missing columns: {', '.join(missing)}")
+        chunk["amount"] = pd.to_numeric(
+            chunk["amount"].str.replace(",", "", regex=False), errors="coerce"
+        )
+        chunk["currency"] = chunk["currency"].str.strip().str.upper()
+        chunks.append(chunk.dropna(subset=["description", "amount", "currency"]))
+
+    currencies = set().union(*(set(chunk["currency"]) for chunk in chunks))
+    unknown = currencies - set(get_rate_table()["rates"])
+    if unknown:
+        raise ValueError(f"No exchange rate for: {', '.join(sorted(unknown))}")
+
+    negative = sum(int((chunk["amount"] < 0).sum()) for chunk in chunks)
+    positive = sum(int((chunk["amount"] > 0).sum()) for chunk in chunks)
+    spending_sign = -1 if negative > positive else 1
+
+    imported = 0
+    for chunk in chunks:
+        chunk = chunk[chunk["amount"] * spending_sign > 0]
+        names = chunk["description"].str.strip().tolist()
+        ledger.extend(
+            names,
+            categorize_expenses(names),
+            chunk["amount"].abs().to_numpy(),
+            chunk["currency"].tolist(),
+        )
+        imported += len(chunk)
+    return imported
+
+
+@traced()
+def render_category_chart(expenses_by_category):
+    # Wedges must be positive; categories netting to zero or less are left out
+    expenses_by_category = {
+        category: amount
+        for category, amount in expenses_by_category.items()
+        if amount > 0
+    }
+    if not expenses_by_category:
+        return None
+    fig, ax = plt.subplots()
+    ax.pie(
+        list(expenses_by_category.values()),
+        labels=list(expenses_by_category.keys()),
+        autopct="%1.1f%%",
+        startangle=90,
+    )
+    ax.axis("equal")
+    chart = BytesIO()
+    fig.savefig(chart, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return chart.getvalue()
+
+
 def forex():
     st.title("Expense Manager")
     col1, col2 = st.columns(2)
@@ -146,6 +287,7 @@ def forex():
     if home_currency and foreign_currency:
         try:
             exchange_rate = get_exchange_rate(home_currency, foreign_currency)
+            st.caption(format_rates_age(get_rate_table()))
         except Exception as e:
             st.error(f"Error: {e}")
 
@@ -155,52 +297,66 @@ def forex():
         f"Enter the expense in foreign currency ({foreign_currency}):", value=0.0
     )
 
-    # Add expenses to a table
-    if "expense_table" not in st.session_state:
-        st.session_state.expense_table = []
+    # Add expenses to the ledger; amounts stay in the currency they were spent
+    # in and are converted to the home currency when displayed
+    if "expense_ledger" not in st.session_state:
+        st.session_state.expense_ledger = ExpenseLedger()
+    ledger = st.session_state.expense_ledger
 
     if st.button("Add Expense"):
         if expense_name and foreign_expense and home_currency and foreign_currency:
             try:
-                converted_expense = convert_expense(
-                    foreign_expense, foreign_currency, home_currency
-                )
                 expenses_category = categorize_expense(expense_name)
-                new_expense = {
-                    "Expense Name": expense_name,
-                    "Expense Category": expenses_category,
-                    f"Expense in {foreign_currency}": foreign_expense,
-                    f"Expense in {home_currency}": converted_expense,
-                }
-                st.session_state.expense_table.append(new_expense)
+                ledger.append(
+                    expense_name, expenses_category, foreign_expense, foreign_currency
+                )
             except Exception as e:
                 st.error(f"Error: {e}")
         else:
             st.warning("Please fill in all the required fields.")
 
+    # Bulk import from a card or bank statement export
+    statement_file = st.file_uploader(
+        "Import a card or bank statement (CSV with date, description, amount, currency):",
+        type="csv",
+    )
+    if statement_file is not None and st.button("Import Statement"):
+        try:
+            imported = import_statement(statement_file, ledger)
+            st.success(f"Imported {imported} expenses.")
+        except Exception as e:
+            st.error(f"Error: {e}")
+
     # Display expenses table
-    if st.session_state.expense_table:
-        expenses_df = pd.DataFrame(st.session_state.expense_table)
+    if len(ledger):
+        try:
+            expenses_df = ledger.to_frame(home_currency, get_exchange_rate)
+            expenses_by_category = ledger.category_totals(
+                home_currency, get_exchange_rate
+            )
+        except Exception as e:
+            st.error(f"Error: {e}")
+            return
         st.write("Expenses Table:")
-        st.table(expenses_df)
+        st.dataframe(expenses_df)
 
         # Display total home currency spent
-        total_home_currency = expenses_df[f"Expense in {home_currency}"].sum()
-
-        # Pie chart of expense
-        expenses_by_category = expenses_df.groupby(["Expense Category"]).sum()[
-            f"Expense in {home_currency}"
-        ]
-        fig, ax = plt.subplots()
-        ax.pie(
-            expenses_by_category,
-            labels=expenses_by_category.index,
-            autopct="%1.1f%%",
-            startangle=90,
-        )
-        ax.axis("equal")
-        st.write("Total Expenses by Category:")
-        st.pyplot(fig)
+        total_home_currency = sum(expenses_by_category.values())
+
+        # Pie chart of expense, redrawn only when the totals can have changed
+        chart_key = (ledger.version, home_currency, get_rate_table()["fetched_at"])
+        if st.session_state.get("expense_chart_key") != chart_key:
+            try:
+                st.session_state.expense_chart = render_category_chart(
+                    expenses_by_category
+                )
+            except Exception as e:
+                st.session_state.expense_chart = None
+                st.warning(f"Could not draw the expense chart: {e}")
+            st.session_state.expense_chart_key = chart_key
+        if st.session_state.expense_chart is not None:
+            st.write("Total Expenses by Category:")
+            st.image(st.session_state.expense_chart)
 
         # Display metrics side by side
         with col1:
@@ -213,7 +369,7 @@ def forex():
 
         # Add a button to reset expenses
         if st.button("Reset Expenses"):
-            st.session_state.expense_table = []
+            ledger.clear()
             st.experimental_rerun()
     else:
         st.write("No expenses added yet.")
@@ -1,68 +1,60 @@
 import os
+import re
 
-import openai
-import requests
 import streamlit as st
 from dotenv import load_dotenv
 
-from core_helpers import translate_latin_text, translate_text
+from core_helpers import translate_batch
+from locale_index import language_name, place_languages
+from metrics import traced
+from openai_client import complete_prompt
+from task_graph import run_task_graph
 
 load_dotenv()
 # load_dotenv()
-openai.api_key = os.environ.get("OPEN_AI_API")
 unsplash_api_key = os.environ.get("UNSPLASH_API_KEY")
 
+# How long cached LLM answers stay valid, in seconds
+LANGUAGE_CACHE_TTL = 30 * 24 * 60 * 60
+PHRASEBOOK_CACHE_TTL = 7 * 24 * 60 * 60
 
+# Several cities can be entered at once, separated by semicolons; commas
+# stay inside one place, as in "Kyoto, Japan"
+CITY_SEPARATOR = re.compile(r"[;\n]")
+
+
+@traced()
 def get_city_language(city):
     """Get the language spoken in a particular city."""
-    prompt = f"What language is spoken in {city}?"
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "max_tokens": 1024,
-        "temperature": 1,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
-    )
-    language = response.json()
-    return language["choices"][0]["message"]["content"].strip()
+    # Known cities and countries are answered from the local index
+    languages = place_languages(city)
+    if languages:
+        return language_name(languages[0])
+    prompt = f"What language is spoken in {city}? Answer with only the name of the main language."
+    return complete_prompt(prompt, temperature=0, cache_ttl=LANGUAGE_CACHE_TTL)
 
 
-# Define the create_phrasebook() function
-def generate_phrasebook(city_name, language):
-    openai_api_key = openai.api_key
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
+@traced()
+def get_example_translations(language):
+    return translate_batch(["Hello", "Goodbye"], language)
+
+
+@traced()
+def fetch_phrasebook(city_name, language, examples):
+    hello, goodbye = examples
     prompt = (
         f"Please provide common phrases in {city_name} used by the locals for better understanding. Maintain decorum and language at all times."
         f"Please provide the phrase in the original language followed by a colon (:) and then the latin text translation in {language} separated by a line break.\n\n"
-        f"For example:\nHello: {translate_latin_text('Hello', language)}\nGoodbye: {translate_latin_text('Goodbye', language)}"
-    )
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "system", "content": prompt}],
-        "temperature": 0.5,
-        "max_tokens": 1024,
-    }
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions", headers=headers, json=data
+        f"For example:\nHello: {hello['latin']}\nGoodbye: {goodbye['latin']}"
     )
-    response_json = response.json()
+    return complete_prompt(prompt, temperature=0.5, cache_ttl=PHRASEBOOK_CACHE_TTL)
 
-    phrasebook = response_json["choices"][0]["message"]["content"].strip()
 
+def render_phrasebook(phrasebook, title="PHRASEBOOK"):
     phrasebook_lines = phrasebook.split("\n")
 
     st.write(
-        "<h1 style='color: #4FB0AE; font-size: 36px; font-weight: bold; text-align: center;'>PHRASEBOOK</h1>",
+        f"<h1 style='color: #4FB0AE; font-size: 36px; font-weight: bold; text-align: center;'>{title}</h1>",
         unsafe_allow_html=True,
     )
 
@@ -78,6 +70,31 @@ def generate_phrasebook(city_name, language):
     st.markdown(phrasebook_text, unsafe_allow_html=True)
 
 
+# Define the create_phrasebook() function
+def generate_phrasebook(city_name, language):
+    examples = get_example_translations(language)
+    render_phrasebook(fetch_phrasebook(city_name, language, examples))
+
+
+def phrasebook_tasks(cities):
+    """Dependency graph of the LLM calls behind the phrasebooks of ``cities``.
+
+    Each city needs its language, then the example translations, then the
+    phrasebook; the chains of different cities run side by side.
+    """
+    tasks = {}
+    for city in cities:
+        tasks[(city, "language")] = (lambda city=city: get_city_language(city), [])
+        tasks[(city, "examples")] = (get_example_translations, [(city, "language")])
+        tasks[(city, "phrasebook")] = (
+            lambda language, examples, city=city: fetch_phrasebook(
+                city, language, examples
+            ),
+            [(city, "language"), (city, "examples")],
+        )
+    return tasks
+
+
 def manual():
     # Set up Streamlit app
     st.markdown(
@@ -87,10 +104,32 @@ def manual():
         unsafe_allow_html=True,
     )
     # Get user input for YouTube video URL
-    city = st.text_input("Enter Cities you want to explore")
+    city_input = st.text_input("Enter Cities you want to explore")
     if st.button("Generate Phrasebook"):
-        language = get_city_language(city)
-        generate_phrasebook(city, language)
+        cities = list(
+            dict.fromkeys(
+                city.strip()
+                for city in CITY_SEPARATOR.split(city_input)
+                if city.strip()
+            )
+        )
+        # One slot per city, filled in as soon as each of its steps finishes
+        sections = {city: st.container() for city in cities}
+        title = "PHRASEBOOK" if len(cities) == 1 else None
+        for (city, step), future in run_task_graph(phrasebook_tasks(cities)):
+            with sections[city]:
+                if future.exception() is not None:
+                    # Dependent steps fail with the same error; report it once
+                    if step == "phrasebook":
+                        st.error(
+                            f"Could not generate a phrasebook for {city}: {future.exception()}"
+                        )
+                elif step == "language":
+                    st.caption(f"{city}: {future.result()}")
+                elif step == "phrasebook":
+                    render_phrasebook(
+                        future.result(), title or f"PHRASEBOOK: {city.upper()}"
+                    )
 
 
 if __name__ == "__main__":
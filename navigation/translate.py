@@ -1,40 +1,17 @@
 import base64
 import os
 import tempfile
-from io import BytesIO
 
 import streamlit as st
 from dotenv import load_dotenv
-from google.cloud import texttospeech
 
 from core_helpers import translate_text
+from tts_helpers import synthesize_speech
 
 load_dotenv()
 GOOGLE_APPLICATION_CREDENTIALS = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
 
 
-def synthesize_speech(text, language):
-    client = texttospeech.TextToSpeechClient()
-
-    input_text = texttospeech.SynthesisInput(text=text)
-    voice = texttospeech.VoiceSelectionParams(
-        language_code=language,
-        ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
-    )
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3
-    )
-
-    response = client.synthesize_speech(
-        request={"input": input_text, "voice": voice, "audio_config": audio_config}
-    )
-
-    audio_content = response.audio_content
-    audio_file = BytesIO(audio_content)
-
-    return audio_file
-
-
 def translate():
     st.markdown(
         """
@@ -55,17 +32,24 @@ def translate():
     # Translate button
     if st.button("Translate"):
         if input_text and target_language:
-            (
-                translated_text,
-                translated_latin_text,
-                target_language_code,
-            ) = translate_text(input_text, target_language)
+            try:
+                (
+                    translated_text,
+                    translated_latin_text,
+                    target_language_code,
+                ) = translate_text(input_text, target_language)
+            except Exception as e:
+                st.error(f"Could not translate the text: {e}")
+                return
             st.write(f"Translated text in {target_language}:")
             st.write(translated_text)
-            st.write(translated_latin_text)
-            translated_text = translated_text.split(":", 1)[-1].strip()
-            audio_content = synthesize_speech(translated_text, target_language_code)
-            st.audio(audio_content, format="audio/wav")
+            st.write(f"Latin Script: {translated_latin_text}")
+            try:
+                audio_content = synthesize_speech(translated_text, target_language_code)
+            except Exception as e:
+                st.error(f"Could not synthesize speech: {e}")
+                return
+            st.audio(audio_content, format="audio/mp3")
 
         else:
             st.warning("Please provide both input text and target language.")
@@ -1,6 +1,4 @@
 import os
-import requests
-import openai
 import streamlit as st
 from dotenv import load_dotenv
 from reportlab.lib.pagesizes import letter
@@ -9,43 +7,51 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Tabl
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import inch
 import base64
+import hashlib
 import io
+import threading
+import time
+from collections import OrderedDict
 from io import BytesIO
 
+from admission_control import BULK
+from chat_context import ChatContext
 from core_helpers import (
     download_audio,
     generate_itinerary_by_youtube,
     get_gpt_answer,
     render_conversation,
-    transcribe_audio,
+    render_stream,
+    transcribe_audio_detailed,
 )
+from image_helpers import PDF_IMAGE_SIZE, prefetch_pdf_images, resolve_images
+from job_queue import DONE, FAILED, get_job_queue
+from metrics import span, traced
+from openai_client import OpenAIClientError
+from transcript_store import extract_video_id, get_or_create_transcript
 
 load_dotenv()
-openai.api_key = os.environ.get("OPEN_AI_API")
 unsplash_api_key = os.environ.get("UNSPLASH_API_KEY")
 
+# Derived artifacts of recent itineraries, shared across sessions
+ARTIFACT_CACHE_SIZE = 32
+_artifact_cache = OrderedDict()
+_artifact_lock = threading.Lock()
 
+# How often the page re-checks a running itinerary job, in seconds
+JOB_POLL_INTERVAL = 1.0
+
+
+@traced()
 def extract_locations_from_itinerary(itinerary):
     prompt = f"Please list the locations mentioned in the following itinerary, ignoring the day labels:\n\n{itinerary}\n\nLocations:\n"
-    response = get_gpt_answer(prompt)
+    # Not on the chat path, so it yields to interactive requests
+    response = get_gpt_answer(prompt, priority=BULK)
     locations = response.strip().split("\n")
     return locations
 
 
-def get_unsplash_image(query, api_key):
-    headers = {"Authorization": f"Client-ID {api_key}"}
-    params = {"query": query, "orientation": "landscape", "per_page": 1}
-    response = requests.get(
-        "https://api.unsplash.com/search/photos", headers=headers, params=params
-    )
-
-    if response.status_code == 200:
-        data = response.json()
-        if data["results"]:
-            return data["results"][0]["urls"]["small"]
-    return None
-
-
+@traced()
 def generate_pdf(itinerary, image_paths):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -65,32 +71,35 @@ def generate_pdf(itinerary, image_paths):
     for line in itinerary.split("\n"):
         story.append(Paragraph(line, itinerary_style))
 
+    # Fetch, downscale and recompress all images up front, then lay them out
+    width, height = PDF_IMAGE_SIZE
+    image_buffers = prefetch_pdf_images([url for url, _ in image_paths])
+    image_paths = [
+        (url, caption) for url, caption in image_paths if url in image_buffers
+    ]
+
     # Iterate over the image_paths and add the images and captions to the PDF
     for i in range(0, len(image_paths), 2):
         img1_url, img1_caption = image_paths[i]
-        img1 = Image(requests.get(img1_url, stream=True).raw)
-        img1.drawHeight = 200
-        img1.drawWidth = 270
+        img1 = Image(image_buffers[img1_url], width=width, height=height)
         img1.hAlign = "LEFT"
         caption1 = Paragraph(img1_caption, styles["BodyText"])
 
         if i + 1 < len(image_paths):
             img2_url, img2_caption = image_paths[i + 1]
-            img2 = Image(requests.get(img2_url, stream=True).raw)
-            img2.drawHeight = 200
-            img2.drawWidth = 270
+            img2 = Image(image_buffers[img2_url], width=width, height=height)
             img2.hAlign = "RIGHT"
             caption2 = Paragraph(img2_caption, styles["BodyText"])
 
             # Create a row with two images and their captions
             image_row = [[img1, img2], [caption1, caption2]]
+            col_widths = [width + 10 * inch / 72, width]
         else:
             image_row = [[img1], [caption1]]
+            col_widths = [width + 10 * inch / 72]
 
         # Add the row to the story
-        table = Table(
-            image_row, colWidths=[img1.drawWidth + 10 * inch / 72, img2.drawWidth]
-        )
+        table = Table(image_row, colWidths=col_widths)
         table.setStyle(
             [
                 ("ALIGN", (0, 0), (-1, -1), "CENTER"),
@@ -111,6 +120,123 @@ def generate_pdf(itinerary, image_paths):
     return buffer
 
 
+def format_itinerary_html(itinerary):
+    formatted_itinerary = ""
+    for day in itinerary.split("\n"):
+        if day.startswith("Day"):
+            formatted_itinerary += (
+                f"<span style='color: #cfd4d3; font-weight: bold;'>{day}</span><br>"
+            )
+        else:
+            formatted_itinerary += (
+                f"<span style='color: #4FB0AE; font-weight: bold;'>{day}</span><br>"
+            )
+    return formatted_itinerary
+
+
+@traced()
+def build_itinerary_artifacts(itinerary):
+    """Compute everything the page derives from an itinerary: HTML, locations,
+    images and the PDF."""
+    locations_list = extract_locations_from_itinerary(itinerary)
+    # Check if the locations are concatenated in a single string or spread across a list
+    if len(locations_list) == 1 and "," in locations_list[0]:
+        locations = locations_list[0].split(", ")
+    else:
+        locations = locations_list
+
+    # Resolve every location once, concurrently, for both the page and the PDF
+    cleaned_locations = [location.strip("- ").strip() for location in locations]
+    image_urls = resolve_images(cleaned_locations, unsplash_api_key)
+    image_paths = [
+        (image_urls[cleaned_location], cleaned_location)
+        for cleaned_location in cleaned_locations
+        if image_urls.get(cleaned_location)
+    ]
+
+    pdf_buffer = generate_pdf(itinerary, image_paths)
+    return {
+        "html": format_itinerary_html(itinerary),
+        "locations": cleaned_locations,
+        "image_urls": image_urls,
+        "pdf": pdf_buffer.getvalue(),
+    }
+
+
+def get_itinerary_artifacts(itinerary):
+    """Return the derived artifacts for ``itinerary``, building them only when
+    its content has not been seen before."""
+    digest = hashlib.sha256(itinerary.encode("utf-8")).hexdigest()
+    artifacts = st.session_state.get("itinerary_artifacts")
+    if artifacts is not None and artifacts["hash"] == digest:
+        return artifacts
+
+    with _artifact_lock:
+        artifacts = _artifact_cache.get(digest)
+        if artifacts is not None:
+            _artifact_cache.move_to_end(digest)
+    if artifacts is None:
+        artifacts = {"hash": digest, **build_itinerary_artifacts(itinerary)}
+        with _artifact_lock:
+            _artifact_cache[digest] = artifacts
+            while len(_artifact_cache) > ARTIFACT_CACHE_SIZE:
+                _artifact_cache.popitem(last=False)
+
+    st.session_state.itinerary_artifacts = artifacts
+    return artifacts
+
+
+@traced()
+def run_itinerary_job(job, url, days):
+    """Job body for the job queue: transcript, then a streamed itinerary."""
+
+    def create_transcript(url):
+        job.report(stage="Downloading audio", progress=0.05)
+        audio = download_audio(url)
+        job.report(stage="Transcribing audio", progress=0.2)
+        return transcribe_audio_detailed(
+            audio,
+            progress=lambda done, total: job.report(progress=0.2 + 0.5 * done / total),
+        )
+
+    job.report(stage="Fetching transcript")
+    # Download and transcribe the audio, unless this video was seen before
+    transcript = get_or_create_transcript(url, create_transcript)["text"]
+
+    job.report(stage="Writing itinerary", progress=0.75)
+    itinerary = ""
+    for token in generate_itinerary_by_youtube(transcript, days, stream=True):
+        itinerary += token
+        job.report(partial=itinerary)
+    return itinerary.strip()
+
+
+def poll_itinerary_job():
+    """Show the progress of the session's itinerary job and rerun the page
+    until it finishes; a finished itinerary moves into the session state."""
+    job = get_job_queue().get(st.session_state.itinerary_job)
+    if job is None:
+        st.session_state.itinerary_job = None
+        return
+    snapshot = job.snapshot()
+    if snapshot["status"] == DONE:
+        st.session_state.itinerary_job = None
+        st.session_state.itinerary = snapshot["result"]
+        st.success("Itinerary Generated!")
+        return
+    if snapshot["status"] == FAILED:
+        st.session_state.itinerary_job = None
+        st.error(f"Could not generate the itinerary: {snapshot['error']}")
+        return
+
+    st.progress(snapshot["progress"])
+    st.caption(f"{snapshot['stage']}...")
+    if snapshot["partial"]:
+        st.markdown(snapshot["partial"] + "▌")
+    time.sleep(JOB_POLL_INTERVAL)
+    st.experimental_rerun()
+
+
 def get_binary_file_downloader_link(file_path, file_label="File"):
     with open(file_path, "rb") as f:
         data = f.read()
@@ -130,18 +256,23 @@ def youtube():
     # Initialize session state variables
     if "itinerary" not in st.session_state:
         st.session_state.itinerary = None
+    if "itinerary_job" not in st.session_state:
+        st.session_state.itinerary_job = None
 
-    # If URL is provided, extract the audio, transcribe it, and display the result
+    # The pipeline runs as a background job; sessions asking for the same
+    # video and number of days share one run
     if st.button("Get Itinerary"):
-        # Download audio from YouTube video
-        audio_content = download_audio(url)
-        st.write(audio_content)
-        # Transcribe audio using OpenAI API
-        transcript = transcribe_audio(audio_content)
-        # Display transcript
-        itinerary = generate_itinerary_by_youtube(transcript, days)
-        st.session_state.itinerary = itinerary
-        st.success("Itinerary Generated!")
+        try:
+            key = (extract_video_id(url), days)
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            job = get_job_queue().submit(key, run_itinerary_job, url, days)
+            st.session_state.itinerary_job = job.id
+            st.session_state.itinerary = None
+
+    if st.session_state.itinerary_job:
+        poll_itinerary_job()
 
     # New section: Ask questions about the itinerary
     if st.session_state.itinerary:
@@ -150,65 +281,36 @@ def youtube():
             unsafe_allow_html=True,
         )
 
-        itinerary_days = st.session_state.itinerary.split("\n")
-        formatted_itinerary = ""
-        for day in itinerary_days:
-            if day.startswith("Day"):
-                formatted_itinerary += (
-                    f"<span style='color: #cfd4d3; font-weight: bold;'>{day}</span><br>"
-                )
-            else:
-                formatted_itinerary += (
-                    f"<span style='color: #4FB0AE; font-weight: bold;'>{day}</span><br>"
-                )
+        # Reruns (e.g. chat turns) reuse the artifacts of an unchanged itinerary
+        artifacts = get_itinerary_artifacts(st.session_state.itinerary)
 
         st.write(
-            f"<div style='border: 3px solid #39FF14; padding: 10px; border-radius: 5px;'>{formatted_itinerary}</div>",
+            f"<div style='border: 3px solid #39FF14; padding: 10px; border-radius: 5px;'>{artifacts['html']}</div>",
             unsafe_allow_html=True,
         )
 
-        locations_list = extract_locations_from_itinerary(st.session_state.itinerary)
-        # Check if the locations are concatenated in a single string or spread across a list
-        if len(locations_list) == 1 and "," in locations_list[0]:
-            locations = locations_list[0].split(", ")
-        else:
-            locations = locations_list
-
         st.header("Locations with Images")
 
-        location_iter = iter(locations)
-        for location in location_iter:
-            cleaned_location1 = location.strip("- ").strip()
-            image_url1 = get_unsplash_image(cleaned_location1, unsplash_api_key)
-
-            try:
-                location = next(location_iter)
-                cleaned_location2 = location.strip("- ").strip()
-                image_url2 = get_unsplash_image(cleaned_location2, unsplash_api_key)
-            except StopIteration:
-                cleaned_location2 = None
-                image_url2 = None
-
+        cleaned_locations = artifacts["locations"]
+        image_urls = artifacts["image_urls"]
+        for i in range(0, len(cleaned_locations), 2):
             col1, col2 = st.columns(2)
-
-            if cleaned_location1 and image_url1:
-                col1.image(image_url1, caption=cleaned_location1, use_column_width=True)
-
-            if cleaned_location2 and image_url2:
-                col2.image(image_url2, caption=cleaned_location2, use_column_width=True)
-        image_paths = []
-        for location in locations:
-            cleaned_location = location.strip("- ").strip()
-            image_url = get_unsplash_image(cleaned_location, unsplash_api_key)
-            image_paths.append((image_url, cleaned_location))
-
-        pdf_path = "itinerary.pdf"
-        pdf_buffer = generate_pdf(st.session_state.itinerary, image_paths)
-        b64_pdf = base64.b64encode(pdf_buffer.getvalue()).decode()
+            for col, cleaned_location in zip(
+                (col1, col2), cleaned_locations[i : i + 2]
+            ):
+                image_url = image_urls.get(cleaned_location)
+                if cleaned_location and image_url:
+                    col.image(
+                        image_url, caption=cleaned_location, use_column_width=True
+                    )
+
+        b64_pdf = base64.b64encode(artifacts["pdf"]).decode()
         pdf_display = f'<a href="data:application/pdf;base64,{b64_pdf}" download="itinerary.pdf">Download Itinerary</a>'
         st.markdown(pdf_display, unsafe_allow_html=True)
         if "conversation_history" not in st.session_state:
             st.session_state.conversation_history = []
+        if "chat_context" not in st.session_state:
+            st.session_state.chat_context = ChatContext()
 
         # Display previous questions and answers
         st.header("Intelligent Chat")
@@ -218,15 +320,28 @@ def youtube():
 
         user_question = st.text_input("Enter your question about the itinerary:")
         if st.button("Ask Question"):
-            prompt = f"My travel itinerary is\n{st.session_state.itinerary}\n\n"
-            for qa in st.session_state.conversation_history:
-                prompt += f"{qa}\n"
-            prompt += f"User: {user_question}\ngpt-3.5-turbo:"
-            answer = get_gpt_answer(prompt)
+            # Only recent turns, a rolling summary and the relevant days are sent
+            prompt = st.session_state.chat_context.build_prompt(
+                st.session_state.itinerary, user_question
+            )
+            answer_placeholder = st.empty()
+            try:
+                with span("navigation.youtube.chat"):
+                    answer = render_stream(
+                        get_gpt_answer(prompt, stream=True), answer_placeholder
+                    )
+            except OpenAIClientError as exc:
+                answer_placeholder.error(f"Could not answer the question: {exc}")
+                return
 
             st.session_state.conversation_history.append(f"User: {user_question}")
             st.session_state.conversation_history.append(f"gpt-3.5-turbo: {answer}")
-            st.text_area(f"gpt-3.5-turbo:", value=answer)
+            try:
+                st.session_state.chat_context.add_turn(user_question, answer)
+            except OpenAIClientError:
+                # The turn stays verbatim; folding is retried after the next one
+                pass
+            answer_placeholder.text_area(f"gpt-3.5-turbo:", value=answer)
 
 
 if __name__ == "__main__":
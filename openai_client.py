@@ -0,0 +1,388 @@
+import json
+import os
+import threading
+import time
+
+import requests
+import tiktoken
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from admission_control import INTERACTIVE, AdmissionController
+from disk_cache import CACHE_DIR, DiskCache, make_key
+from metrics import record_audio, record_span, record_tokens, span
+
+# Base URL of the chat-completions API. Point OPENAI_API_BASE at a local
+# stand-in to run the app without hitting OpenAI.
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+DEFAULT_MODEL = "gpt-3.5-turbo"
+# Context window of DEFAULT_MODEL, and the tokens the chat format adds around
+# a prompt
+CONTEXT_TOKENS = 4096
+PROMPT_OVERHEAD_TOKENS = 64
+
+# Connection pool and retry settings
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+# 429s are not retried by urllib3: the admission controller pauses and
+# re-admits them, so the retries count against the rate limits
+RETRY_STATUSES = (500, 502, 503, 504)
+REQUEST_TIMEOUT = (5, 120)
+TRANSCRIBE_TIMEOUT = (5, 600)
+
+# Account rate limits shared by every request this process makes. The
+# defaults are OpenAI's pay-as-you-go limits for gpt-3.5-turbo and Whisper.
+OPENAI_RPM = int(os.environ.get("OPENAI_RPM", 3500))
+OPENAI_TPM = int(os.environ.get("OPENAI_TPM", 90000))
+OPENAI_AUDIO_RPM = int(os.environ.get("OPENAI_AUDIO_RPM", 50))
+# Pause after a 429 that carries no Retry-After header, in seconds
+RATE_LIMIT_PAUSE = 10
+# Per-message overhead of the chat format, in tokens
+MESSAGE_TOKENS = 4
+# Token estimate used when tiktoken's encoding cannot be downloaded, and how
+# often to retry the download meanwhile, in seconds
+CHARS_PER_TOKEN = 4
+ENCODING_RETRY_INTERVAL = 60
+
+# Persistent response cache shared by every process using the same cache dir
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm_cache.sqlite3")
+)
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+_encoding = None
+_encoding_retry_at = 0.0
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+class OpenAIClientError(RuntimeError):
+    pass
+
+
+class RateLimitError(OpenAIClientError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_session():
+    """Return the process-wide pooled session shared by every page and session."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=MAX_RETRIES,
+                    backoff_factor=BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(["GET", "POST"]),
+                    # Otherwise urllib3 retries any 429 carrying Retry-After
+                    respect_retry_after_header=False,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_admission_controller(endpoint="chat"):
+    """Return the process-wide admission controller for ``endpoint`` ("chat"
+    or "audio"), which every page and helper share."""
+    controller = _controllers.get(endpoint)
+    if controller is None:
+        with _controllers_lock:
+            controller = _controllers.get(endpoint)
+            if controller is None:
+                if endpoint == "audio":
+                    controller = AdmissionController(OPENAI_AUDIO_RPM)
+                else:
+                    controller = AdmissionController(OPENAI_RPM, OPENAI_TPM)
+                _controllers[endpoint] = controller
+    return controller
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+    return _cache
+
+
+class ApproximateEncoding:
+    """Stand-in for tiktoken's encoding without network access: every
+    CHARS_PER_TOKEN characters count as one token."""
+
+    def encode(self, text):
+        return [
+            text[i : i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)
+        ]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def get_encoding():
+    global _encoding, _encoding_retry_at
+    if _encoding is None and time.monotonic() >= _encoding_retry_at:
+        try:
+            _encoding = tiktoken.encoding_for_model(DEFAULT_MODEL)
+        except Exception:
+            # tiktoken downloads the encoding on first use; until a later
+            # attempt succeeds, budgets and rate limits run on an estimate
+            _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+    return _encoding or ApproximateEncoding()
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text))
+
+
+def split_by_tokens(text, max_tokens):
+    """Split ``text`` into consecutive pieces of at most ``max_tokens`` tokens."""
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    return [
+        encoding.decode(tokens[i : i + max_tokens])
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+def estimate_chat_tokens(data):
+    """Upper bound on the tokens a chat request counts against the TPM limit:
+    the prompt plus the requested completion length."""
+    prompt_tokens = sum(
+        count_tokens(message["content"]) + MESSAGE_TOKENS
+        for message in data["messages"]
+    )
+    return prompt_tokens + data.get("max_tokens", 0)
+
+
+def get_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {os.environ.get('OPEN_AI_API')}",
+    }
+
+
+def chat_completion(
+    messages,
+    model=DEFAULT_MODEL,
+    max_tokens=1024,
+    temperature=0.6,
+    cache_ttl=None,
+    validate=None,
+    priority=INTERACTIVE,
+    **params,
+):
+    """Return the assistant reply for ``messages``.
+
+    Passing ``cache_ttl`` (seconds) serves identical requests from the
+    persistent response cache; leave it unset for non-deterministic calls
+    such as chat. ``validate`` is called with a fresh reply before it is
+    cached, so a reply it rejects by raising is never stored. Requests wait
+    for the rate limits in ``priority`` order; pass ``BULK`` for background
+    work.
+    """
+    data = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        **params,
+    }
+    if cache_ttl is not None:
+        key = make_key("chat", data)
+        cached = get_cache().get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+    content = _post_chat_completion(data, priority)
+    if validate is not None:
+        validate(content)
+    if cache_ttl is not None:
+        get_cache().set(key, content.encode("utf-8"), ttl=cache_ttl)
+    return content
+
+
+def _error_message(response):
+    try:
+        return response.json().get("error", {}).get("message", response.text)
+    except ValueError:
+        return response.text
+
+
+def _check_response(response, controller, field):
+    """Return the parsed body of a successful response; raise RateLimitError
+    on a 429 (pausing ``controller``) and OpenAIClientError otherwise."""
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = RATE_LIMIT_PAUSE
+        controller.pause(retry_after)
+        raise RateLimitError(
+            f"OpenAI rate limit exceeded, retry in {retry_after:.0f}s: "
+            f"{_error_message(response)}",
+            retry_after,
+        )
+    try:
+        response_json = response.json()
+    except ValueError:
+        response_json = {}
+    if response.status_code != 200 or field not in response_json:
+        raise OpenAIClientError(
+            f"OpenAI request failed ({response.status_code}): "
+            f"{_error_message(response)}"
+        )
+    return response_json
+
+
+def _retry_rate_limited(request):
+    """Call ``request()``, again after each RateLimitError up to MAX_RETRIES
+    times. ``request`` acquires its own admission, so each retry waits out
+    the pause the 429 set and is charged like any other request."""
+    for _ in range(MAX_RETRIES):
+        try:
+            return request()
+        except RateLimitError:
+            pass
+    return request()
+
+
+def _post_chat_completion(data, priority=INTERACTIVE):
+    controller = get_admission_controller("chat")
+
+    def request():
+        with span("openai.admission_wait"):
+            charged = controller.acquire(estimate_chat_tokens(data), priority)
+        used = charged
+        try:
+            with span("openai.chat_completion"):
+                response = get_session().post(
+                    f"{OPENAI_API_BASE}/chat/completions",
+                    headers=get_headers(),
+                    json=data,
+                    timeout=REQUEST_TIMEOUT,
+                )
+                response_json = _check_response(response, controller, "choices")
+            used = response_json.get("usage", {}).get("total_tokens", charged)
+        finally:
+            controller.settle(charged, used)
+        return charged, response_json
+
+    charged, response_json = _retry_rate_limited(request)
+
+    # Recorded outside the request span so the calling function gets the usage
+    usage = response_json.get("usage", {})
+    record_tokens(
+        data["model"],
+        usage.get("prompt_tokens", charged - data.get("max_tokens", 0)),
+        usage.get("completion_tokens", 0),
+    )
+    return response_json["choices"][0]["message"]["content"].strip()
+
+
+def transcribe(
+    audio_bytes,
+    filename,
+    model="whisper-1",
+    response_format="verbose_json",
+    priority=INTERACTIVE,
+):
+    """Transcribe an audio file with Whisper and return the parsed response."""
+    controller = get_admission_controller("audio")
+
+    def request():
+        with span("openai.admission_wait"):
+            controller.acquire(priority=priority)
+        with span("openai.transcribe"):
+            response = get_session().post(
+                f"{OPENAI_API_BASE}/audio/transcriptions",
+                headers={"Authorization": get_headers()["Authorization"]},
+                files={"file": (filename, audio_bytes)},
+                data={"model": model, "response_format": response_format},
+                timeout=TRANSCRIBE_TIMEOUT,
+            )
+            return _check_response(response, controller, "text")
+
+    response_json = _retry_rate_limited(request)
+    record_audio(model, response_json.get("duration", 0.0))
+    return response_json
+
+
+def stream_chat_completion(
+    messages,
+    model=DEFAULT_MODEL,
+    max_tokens=1024,
+    temperature=0.6,
+    priority=INTERACTIVE,
+    **params,
+):
+    """Yield the assistant reply for ``messages`` piece by piece as it arrives.
+
+    Streamed responses carry no usage, so the estimate stays charged and the
+    recorded completion tokens are counted locally."""
+    data = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True,
+        **params,
+    }
+    controller = get_admission_controller("chat")
+    prompt_tokens = estimate_chat_tokens(data) - max_tokens
+
+    def request():
+        with span("openai.admission_wait"):
+            controller.acquire(prompt_tokens + max_tokens, priority)
+        response = get_session().post(
+            f"{OPENAI_API_BASE}/chat/completions",
+            headers=get_headers(),
+            json=data,
+            timeout=REQUEST_TIMEOUT,
+            stream=True,
+        )
+        if response.status_code != 200:
+            with response:
+                _check_response(response, controller, "choices")
+        return response
+
+    start = time.perf_counter()
+    reply = []
+    with _retry_rate_limited(request) as response:
+        # Server-sent events are UTF-8 whatever the Content-Type says
+        for line in response.iter_lines():
+            line = line.decode("utf-8")
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:") :].strip()
+            if payload == "[DONE]":
+                break
+            delta = json.loads(payload)["choices"][0].get("delta", {})
+            if delta.get("content"):
+                reply.append(delta["content"])
+                yield delta["content"]
+    record_span("openai.stream_chat_completion", time.perf_counter() - start)
+    record_tokens(model, prompt_tokens, count_tokens("".join(reply)))
+
+
+def complete_prompt(prompt, **kwargs):
+    """Send a single system prompt, the way most helpers in this app talk to GPT."""
+    return chat_completion([{"role": "system", "content": prompt}], **kwargs)
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from disk_cache import CACHE_DIR, DiskCache
+from metrics import traced
+from openai_client import get_session
+
+# Every cross rate is derived from one table quoted against this currency
+REFERENCE_CURRENCY = "EUR"
+RATES_TTL = 6 * 60 * 60
+# After a failed refresh, keep serving the old table this long before retrying
+RATES_RETRY_AFTER = 60
+RATES_FETCH_TIMEOUT = 5
+
+# Any service answering GET /latest?base=XXX with {"rates": {...}}; the
+# default is the API forex-python wraps. Point it at a local stand-in to run
+# without network access
+FOREX_API_BASE = os.environ.get("FOREX_API_BASE", "https://theforexapi.com/api")
+RATES_SNAPSHOT_PATH = os.environ.get(
+    "RATES_SNAPSHOT_PATH", os.path.join(CACHE_DIR, "forex.sqlite3")
+)
+
+_tables = {}
+_tables_lock = threading.Lock()
+_fetch_pool = ThreadPoolExecutor(max_workers=2)
+_snapshots = None
+
+
+class RatesUnavailableError(RuntimeError):
+    pass
+
+
+def get_snapshots():
+    global _snapshots
+    if _snapshots is None:
+        _snapshots = DiskCache(RATES_SNAPSHOT_PATH, 16 * 1024 * 1024)
+    return _snapshots
+
+
+@traced()
+def fetch_rate_table(base):
+    # The request times out on its own, so an abandoned fetch cannot hold a
+    # worker of _fetch_pool forever
+    response = get_session().get(
+        f"{FOREX_API_BASE}/latest", params={"base": base}, timeout=RATES_FETCH_TIMEOUT
+    )
+    response.raise_for_status()
+    rates = response.json()["rates"]
+    return {**rates, base: 1.0}
+
+
+def _load_snapshot(base):
+    value = get_snapshots().get(f"rates:{base}")
+    return json.loads(value) if value is not None else None
+
+
+def _refresh(base, current):
+    """Fetch a fresh table, falling back to ``current`` or the persisted
+    snapshot when the upstream source is slow or unreachable."""
+    now = time.time()
+    try:
+        rates = _fetch_pool.submit(fetch_rate_table, base).result(
+            timeout=RATES_FETCH_TIMEOUT
+        )
+    except Exception as e:
+        table = current or _load_snapshot(base)
+        if table is None:
+            raise RatesUnavailableError(f"Exchange rates unavailable: {e}") from e
+        return {**table, "checked_at": now, "stale": True}
+
+    table = {"base": base, "rates": rates, "fetched_at": now, "checked_at": now}
+    get_snapshots().set(f"rates:{base}", json.dumps(table).encode("utf-8"))
+    return {**table, "stale": False}
+
+
+def get_rate_table(base=REFERENCE_CURRENCY):
+    """Return the cached rate table for ``base``, refreshing it after RATES_TTL.
+
+    The table is a dict with ``rates``, ``fetched_at`` (epoch seconds) and
+    ``stale`` (True when served from an old table because a refresh failed).
+    """
+    with _tables_lock:
+        table = _tables.get(base)
+        now = time.time()
+        if table is not None and (
+            now - table["fetched_at"] < RATES_TTL
+            or now - table["checked_at"] < RATES_RETRY_AFTER
+        ):
+            return table
+        table = _refresh(base, table)
+        _tables[base] = table
+        return table
+
+
+def get_rate(from_currency, to_currency):
+    if from_currency == to_currency:
+        return 1.0
+    rates = get_rate_table()["rates"]
+    for currency in (from_currency, to_currency):
+        if currency not in rates:
+            raise RatesUnavailableError(f"No exchange rate available for {currency}")
+    return rates[to_currency] / rates[from_currency]
@@ -0,0 +1,53 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+MAX_WORKERS = 8
+
+
+def run_task_graph(tasks, max_workers=MAX_WORKERS):
+    """Run a small dependency graph of tasks concurrently.
+
+    ``tasks`` maps a name to ``(function, dependencies)``; each function is
+    called with the results of its dependencies, in order, as soon as they
+    are all available. Yields ``(name, future)`` pairs in completion order
+    so callers can render each result as it arrives; a task whose
+    dependency failed completes with the same exception without running.
+    """
+    for name, (_, dependencies) in tasks.items():
+        unknown = [dependency for dependency in dependencies if dependency not in tasks]
+        if unknown:
+            raise ValueError(f"Task {name!r} depends on unknown tasks {unknown}")
+
+    done = {}
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            progressed = False
+            for name, (function, dependencies) in list(pending.items()):
+                if not all(dependency in done for dependency in dependencies):
+                    continue
+                del pending[name]
+                progressed = True
+                failed = [
+                    done[dependency]
+                    for dependency in dependencies
+                    if done[dependency].exception() is not None
+                ]
+                if failed:
+                    future = Future()
+                    future.set_exception(failed[0].exception())
+                    done[name] = future
+                    yield name, future
+                    continue
+                arguments = [done[dependency].result() for dependency in dependencies]
+                running[pool.submit(function, *arguments)] = name
+
+            if not running:
+                if progressed:
+                    continue
+                raise ValueError(f"Task graph has a cycle among {list(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                done[name] = future
+                yield name, future
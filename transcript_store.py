@@ -0,0 +1,102 @@
+import json
+import os
+import re
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from disk_cache import CACHE_DIR, DiskCache
+
+TRANSCRIPT_STORE_PATH = os.environ.get(
+    "TRANSCRIPT_STORE_PATH", os.path.join(CACHE_DIR, "transcripts.sqlite3")
+)
+TRANSCRIPT_STORE_MAX_BYTES = int(
+    os.environ.get("TRANSCRIPT_STORE_MAX_BYTES", 512 * 1024 * 1024)
+)
+
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+VIDEO_ID_PATH_PREFIXES = ("embed", "shorts", "live", "v", "e")
+
+_store = None
+_store_lock = threading.Lock()
+_video_locks = {}
+_video_locks_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DiskCache(TRANSCRIPT_STORE_PATH, TRANSCRIPT_STORE_MAX_BYTES)
+    return _store
+
+
+def extract_video_id(url):
+    """Return the canonical 11-character video ID of any YouTube URL form."""
+    url = url.strip()
+    if VIDEO_ID_PATTERN.match(url):
+        return url
+    if "//" not in url:
+        url = f"https://{url}"
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().split(":")[0]
+    parts = [part for part in parsed.path.split("/") if part]
+
+    if host.endswith("youtu.be") and parts:
+        candidate = parts[0]
+    elif "v" in parse_qs(parsed.query):
+        candidate = parse_qs(parsed.query)["v"][0]
+    elif len(parts) >= 2 and parts[0] in VIDEO_ID_PATH_PREFIXES:
+        candidate = parts[1]
+    else:
+        candidate = ""
+
+    if not VIDEO_ID_PATTERN.match(candidate):
+        raise ValueError(f"Could not find a YouTube video ID in {url!r}")
+    return candidate
+
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def get_transcript(video_id):
+    value = get_store().get(video_id)
+    return json.loads(value) if value is not None else None
+
+
+def save_transcript(video_id, transcript):
+    get_store().set(video_id, json.dumps(transcript).encode("utf-8"))
+
+
+def _video_lock(video_id):
+    with _video_locks_lock:
+        return _video_locks.setdefault(video_id, threading.Lock())
+
+
+def get_or_create_transcript(url, create):
+    """Return the stored transcript for the video at ``url``.
+
+    On a miss ``create(url)`` produces it (download and Whisper), called
+    with the canonical watch URL of the video. Sessions asking for the same
+    video at the same time wait for a single run.
+    """
+    video_id = extract_video_id(url)
+    transcript = get_transcript(video_id)
+    if transcript is not None:
+        return transcript
+
+    lock = _video_lock(video_id)
+    try:
+        with lock:
+            transcript = get_transcript(video_id)
+            if transcript is None:
+                # pytube cannot parse a bare ID, so hand it the canonical URL
+                transcript = create(video_url(video_id))
+                save_transcript(video_id, transcript)
+    finally:
+        # Waiters still holding this lock find the saved transcript on retry
+        with _video_locks_lock:
+            if _video_locks.get(video_id) is lock:
+                del _video_locks[video_id]
+    return transcript
@@ -0,0 +1,124 @@
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from disk_cache import CACHE_DIR, DiskCache, make_key
+from metrics import traced
+from openai_client import REQUEST_TIMEOUT, get_session
+
+TTS_CACHE_PATH = os.environ.get(
+    "TTS_CACHE_PATH", os.path.join(CACHE_DIR, "tts.sqlite3")
+)
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+TTS_CACHE_TTL = 30 * 24 * 60 * 60
+TTS_WORKERS = 8
+
+# Point TTS_API_ENDPOINT at a server speaking the Text-to-Speech REST API
+# (POST /v1/text:synthesize), e.g. a local stand-in, to bypass the gRPC client
+TTS_API_ENDPOINT = os.environ.get("TTS_API_ENDPOINT")
+TTS_API_KEY = os.environ.get("TTS_API_KEY")
+
+_client = None
+_cache = None
+_lock = threading.Lock()
+
+
+def get_tts_client():
+    """Return the process-wide Text-to-Speech client; its gRPC channel and
+    credentials are set up once and shared by every session."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from google.cloud import texttospeech
+
+                _client = texttospeech.TextToSpeechClient()
+    return _client
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = DiskCache(TTS_CACHE_PATH, TTS_CACHE_MAX_BYTES)
+    return _cache
+
+
+def _synthesize_rest(text, language, voice_name, encoding):
+    voice = {"languageCode": language}
+    if voice_name:
+        voice["name"] = voice_name
+    else:
+        voice["ssmlGender"] = "NEUTRAL"
+    response = get_session().post(
+        f"{TTS_API_ENDPOINT}/v1/text:synthesize",
+        params={"key": TTS_API_KEY} if TTS_API_KEY else None,
+        json={
+            "input": {"text": text},
+            "voice": voice,
+            "audioConfig": {"audioEncoding": encoding},
+        },
+        timeout=REQUEST_TIMEOUT,
+    )
+    response.raise_for_status()
+    return base64.b64decode(response.json()["audioContent"])
+
+
+def _synthesize_grpc(text, language, voice_name, encoding):
+    from google.cloud import texttospeech
+
+    input_text = texttospeech.SynthesisInput(text=text)
+    if voice_name:
+        voice = texttospeech.VoiceSelectionParams(
+            language_code=language, name=voice_name
+        )
+    else:
+        voice = texttospeech.VoiceSelectionParams(
+            language_code=language,
+            ssml_gender=texttospeech.SsmlVoiceGender.NEUTRAL,
+        )
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding[encoding]
+    )
+
+    response = get_tts_client().synthesize_speech(
+        request={"input": input_text, "voice": voice, "audio_config": audio_config}
+    )
+    return response.audio_content
+
+
+@traced()
+def synthesize_speech_bytes(text, language, voice_name=None, encoding="MP3"):
+    key = make_key("tts", text, language, voice_name, encoding)
+    cached = get_cache().get(key)
+    if cached is not None:
+        return cached
+
+    synthesize = _synthesize_rest if TTS_API_ENDPOINT else _synthesize_grpc
+    audio_content = synthesize(text, language, voice_name, encoding)
+    get_cache().set(key, audio_content, ttl=TTS_CACHE_TTL)
+    return audio_content
+
+
+def synthesize_speech(text, language, voice_name=None, encoding="MP3"):
+    return BytesIO(synthesize_speech_bytes(text, language, voice_name, encoding))
+
+
+def synthesize_speech_batch(
+    texts, language, voice_name=None, encoding="MP3", max_workers=TTS_WORKERS
+):
+    """Synthesize many phrases concurrently; identical phrases are synthesized
+    once. Returns one audio buffer per input text, in order."""
+    unique = list(dict.fromkeys(texts))
+    if not unique:
+        return []
+
+    def synthesize(text):
+        return synthesize_speech_bytes(text, language, voice_name, encoding)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as pool:
+        audio = dict(zip(unique, pool.map(synthesize, unique)))
+    return [BytesIO(audio[text]) for text in texts]
@@ -1,22 +1,72 @@
+import importlib
+import os
+
 import streamlit as st
+from dotenv import load_dotenv
+
+# The app modules read their settings at import time, so .env is loaded
+# before any of them is imported
+load_dotenv()
 
-from navigation.emergency_contacts import emergency
-from navigation.forex import forex
-from navigation.manual import manual
-from navigation.translate import translate
-from navigation.youtube import youtube
+from metrics import snapshot, start_metrics_server  # noqa: E402
 
-# Define the Streamlit pages
+# Set METRICS_DEBUG=1 to show step timings and token usage in the sidebar
+METRICS_DEBUG = os.environ.get("METRICS_DEBUG") == "1"
+
+# Define the Streamlit pages. Each page module is imported the first time it
+# is selected, so opening one page does not pay for every page's dependencies
 pages = {
-    "YouTube": youtube,
-    "Manual": manual,
-    "Translate": translate,
-    "Forex": forex,
-    "Emergency Contacts": emergency,
+    "YouTube": ("navigation.youtube", "youtube"),
+    "Manual": ("navigation.manual", "manual"),
+    "Translate": ("navigation.translate", "translate"),
+    "Forex": ("navigation.forex", "forex"),
+    "Emergency Contacts": ("navigation.emergency_contacts", "emergency"),
 }
 
 
+def load_page(selection):
+    module_name, function_name = pages[selection]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def render_metrics_panel():
+    data = snapshot()
+    with st.sidebar.expander("Performance"):
+        spans = sorted(
+            data["spans"].items(), key=lambda item: item[1]["seconds"], reverse=True
+        )
+        st.table(
+            [
+                {
+                    "step": name,
+                    "calls": stats["count"],
+                    "mean ms": round(1000 * stats["seconds"] / stats["count"], 1),
+                    "max ms": round(1000 * stats["max"], 1),
+                    "errors": stats["errors"],
+                }
+                for name, stats in spans
+            ]
+        )
+        if data["usage"]:
+            st.table(
+                [
+                    {
+                        "function": usage["function"],
+                        "requests": usage["requests"],
+                        "prompt tokens": usage["prompt_tokens"],
+                        "completion tokens": usage["completion_tokens"],
+                        "cost $": round(usage["cost"], 4),
+                    }
+                    for usage in data["usage"]
+                ]
+            )
+            total = sum(usage["cost"] for usage in data["usage"])
+            st.caption(f"Estimated spend since start: ${total:.4f}")
+
+
 def main():
+    # Serves /metrics when METRICS_PORT is set; a no-op on reruns
+    start_metrics_server()
     st.sidebar.title("Navigation")
     if "current_page" not in st.session_state:
         st.session_state.current_page = ""
@@ -27,9 +77,12 @@ def main():
         st.session_state.clear()
         st.session_state.current_page = selection
 
-    page = pages[selection]
+    page = load_page(selection)
     page()
 
+    if METRICS_DEBUG:
+        render_metrics_panel()
+
 
 if __name__ == "__main__":
     main()